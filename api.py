@@ -6,34 +6,101 @@ primarily with communication to/from the API's users."""
 
 import endpoints
 from protorpc import remote, messages
+from google.appengine.api import datastore_errors
 from google.appengine.api import memcache
 from google.appengine.api import taskqueue
 from google.appengine.ext import ndb
-from models import User, Game, Score, GameForms, GameHistory, GameHistoryForms
+from models import User, Game, Score, GameForms, GameHistoryForms
+from models import Leaderboard, UserStats, UserStatsForm
 from models import StringMessage, NewGameForm, GameForm, MakeMoveForm, \
-    ScoreForms
-from utils import get_by_urlsafe
+    ScoreForms, MakeMovesForm, MoveResultForm, MakeMovesResultForm, HintForm
+from utils import get_by_urlsafe, key_from_urlsafe, fetch_page, slice_page
+from utils import get_cached_response, cache_response, wait_after_commit
+import counters
+from instrumentation import instrumented
+import hints
 
 # Uses for new game request
 NEW_GAME_REQUEST = endpoints.ResourceContainer(NewGameForm)
 # Used for getting game info
 GET_GAME_REQUEST = endpoints.ResourceContainer(
     urlsafe_game_key=messages.StringField(1), )
+# Get the game state, unless the client has its current version
+GET_GAME_STATE = endpoints.ResourceContainer(
+    urlsafe_game_key=messages.StringField(1),
+    if_version=messages.StringField(2), )
 # Get the game moves for game
 GET_GAME_HISTORY = endpoints.ResourceContainer(
-    urlsafe_game_key=messages.StringField(1), )
+    urlsafe_game_key=messages.StringField(1),
+    page_size=messages.IntegerField(2),
+    cursor=messages.StringField(3),
+    if_version=messages.StringField(4), )
 # Make an move
 MAKE_MOVE_REQUEST = endpoints.ResourceContainer(
     MakeMoveForm,
     urlsafe_game_key=messages.StringField(1), )
+# Make several moves in one request
+MAKE_MOVES_REQUEST = endpoints.ResourceContainer(
+    MakeMovesForm,
+    urlsafe_game_key=messages.StringField(1), )
 # Information about the user
 USER_REQUEST = endpoints.ResourceContainer(user_name=messages.StringField(1),
                                            email=messages.StringField(2))
 
-GET_USER_GAME = endpoints.ResourceContainer(user_name=messages.StringField(1))
+GET_USER_GAME = endpoints.ResourceContainer(user_name=messages.StringField(1),
+                                            page_size=messages.IntegerField(2),
+                                            cursor=messages.StringField(3))
+GET_SCORES = endpoints.ResourceContainer(page_size=messages.IntegerField(1),
+                                         cursor=messages.StringField(2))
+GET_USER_SCORES = endpoints.ResourceContainer(user_name=messages.StringField(1),
+                                              page_size=messages.IntegerField(2),
+                                              cursor=messages.StringField(3))
 GET_HIGH_SCORE = endpoints.ResourceContainer(user_name=messages.StringField(1),
                                              number_of_results=messages.IntegerField(2))
-MEMCACHE_MOVES_REMAINING = 'MOVES_REMAINING'
+GET_USER_STATS = endpoints.ResourceContainer(
+    user_name=messages.StringField(1))
+GET_HINT = endpoints.ResourceContainer(
+    urlsafe_game_key=messages.StringField(1),
+    number_of_results=messages.IntegerField(2))
+GET_LEADERBOARD = endpoints.ResourceContainer(
+    number_of_results=messages.IntegerField(1))
+MEMCACHE_MOVES_REMAINING = counters.AVERAGE_MEMCACHE_KEY
+# Candidate words returned by get_hint by default
+HINT_CANDIDATES = 20
+# Retries of a move transaction before answering with a conflict
+MOVE_RETRIES = 2
+# Guesses accepted by one make_moves call, one per letter of the alphabet
+MAX_MOVES = 26
+GAME_CONTENTION_MESSAGE = 'The game is being updated by another move, ' \
+                          'try again'
+
+
+def not_modified(service, request, version):
+    """Returns True if the client sent the current version, as the
+    if_version parameter or an If-None-Match header"""
+    client_version = request.if_version
+    if not client_version:
+        # No request state when the service is called outside Endpoints
+        headers = getattr(service.request_state, 'headers', None) or {}
+        client_version = (headers.get('If-None-Match') or '').strip('"')
+    return client_version == version
+
+
+def get_user_with(user_name, lookup_async):
+    """Returns the user named user_name, or None, and the result of
+    lookup_async(user key). Users are keyed by name, so the lookup runs in
+    parallel with the user's; users created before that need a second one."""
+    if not user_name:
+        return None, None
+    name_key = ndb.Key(User, user_name)
+    user_future = User.get_by_name_async(user_name)
+    lookup = lookup_async(name_key)
+    user = user_future.get_result()
+    if not user:
+        return None, None
+    if user.key != name_key:
+        lookup = lookup_async(user.key)
+    return user, lookup.get_result()
 
 
 @endpoints.api(name='hangman', version='1.0')
@@ -45,17 +112,18 @@ class HangmanApi(remote.Service):
                       path='user',
                       name='create_user',
                       http_method='POST')
+    @instrumented
     def create_user(self, request):
         """Create user api"""
-        if User.query(User.name == request.user_name).get():
-            raise endpoints.ConflictException(
-                'A User with that name already exists'
-            )
         # If the user is not given in parameter throw exception
         if not request.user_name:
             raise endpoints.BadRequestException(
                 'Name of the user not given'
             )
+        if User.get_by_name(request.user_name):
+            raise endpoints.ConflictException(
+                'A User with that name already exists'
+            )
         # Ok create the user and return message
         user = User.create_user(request.user_name, request.email)
         return StringMessage(message='User {} created!'.format(
@@ -66,71 +134,175 @@ class HangmanApi(remote.Service):
                       path='game_high_score',
                       name='get_high_score',
                       http_method='GET')
+    @instrumented
     def get_high_score(self, request):
         """Create game api"""
-        user = User.query(User.name == request.user_name).get()
+        # Best scores of the user, won games first then by fewest guesses
+        user, entries = get_user_with(
+            request.user_name,
+            lambda user_key: Leaderboard.top_async(
+                user_key, request.number_of_results or 0))
         if not user:
             raise endpoints.NotFoundException(
                 'A user whit that name does not exists')
-        # Get score from table order by won games ascending by guesses
-        scores = Score.query(Score.user == user.key).order(Score.won).order(Score.guesses)
-        if scores.get() is None:
+        if not entries:
             raise endpoints.NotFoundException(
                 'No games finished till now for user')
-        if request.number_of_results > 0:
-            scores = scores.fetch(request.number_of_results)
-        return ScoreForms(items=[score.to_form() for score in scores])
+        return Leaderboard.to_forms(entries)
+    
+    @endpoints.method(request_message=GET_USER_STATS,
+                      response_message=UserStatsForm,
+                      path='user/stats',
+                      name='get_user_stats',
+                      http_method='GET')
+    @instrumented
+    def get_user_stats(self, request):
+        """Return the games played, win rate, average guesses and streaks
+        of a user"""
+        user, stats = get_user_with(
+            request.user_name,
+            lambda user_key: UserStats.stats_key(user_key).get_async())
+        if not user:
+            raise endpoints.NotFoundException(
+                'A user whit that name does not exists')
+        return (stats or UserStats()).to_form(user.name)
+    
+    @endpoints.method(request_message=GET_LEADERBOARD,
+                      response_message=ScoreForms,
+                      path='leaderboard',
+                      name='get_leaderboard',
+                      http_method='GET')
+    @instrumented
+    def get_leaderboard(self, request):
+        """Return the best scores of all users"""
+        return Leaderboard.to_forms(
+            Leaderboard.top(limit=request.number_of_results or 0))
     
     @endpoints.method(request_message=NEW_GAME_REQUEST,
                       response_message=GameForm,
                       path='game',
                       name='create_game',
                       http_method='POST')
+    @instrumented
     def create_game(self, request):
         """Create game api"""
-        user = User.query(User.name == request.user_name).get()
+        user = User.get_by_name(request.user_name)
         if not user:
             raise endpoints.NotFoundException(
                 'A user whit that name does not exists')
         
-        game = Game.create_game(user.key)
-        taskqueue.add(url='/tasks/send_reminder')
+        try:
+            game = Game.create_game(user.key, request.difficulty,
+                                    request.word_length,
+                                    request.distinct_letters)
+        except ValueError as e:
+            raise endpoints.BadRequestException(str(e))
         return game.to_form('Good luck playing Hangman!')
     
-    @endpoints.method(request_message=GET_GAME_REQUEST,
+    @endpoints.method(request_message=GET_GAME_STATE,
+                      response_message=GameForm,
+                      path='game/{urlsafe_game_key}/state',
+                      name='get_game',
+                      http_method='GET')
+    @instrumented
+    def get_game(self, request):
+        """Return the current game state. When the client already has its
+        version, not_modified is set in the answer."""
+        game = get_by_urlsafe(request.urlsafe_game_key, Game)
+        if not game:
+            raise endpoints.NotFoundException('Game not found!')
+        if not_modified(self, request, game.version):
+            form = game.to_form('Game not modified')
+            form.not_modified = True
+            return form
+        if game.game_over:
+            return game.to_form('Game already over!')
+        return game.to_form('Time to make a move!')
+    
+    @endpoints.method(request_message=GET_GAME_HISTORY,
                       response_message=GameHistoryForms,
                       path='game/{urlsafe_game_key}',
                       name='get_game_history',
                       http_method='GET')
+    @instrumented
     def get_game_history(self, request):
-        """Return the game history."""
+        """Return the game history. Pages are cached by game version, so
+        the history of a finished game is only read once."""
         game = get_by_urlsafe(request.urlsafe_game_key, Game)
 
         # If the game dose't exist throw exception.
         if not game:
             raise endpoints.NotFoundException('Game not found!')
+        version = game.version
+        if not_modified(self, request, version):
+            return GameHistoryForms(version=version, not_modified=True)
+        cache_key = 'history:{}:{}:{}:{}'.format(
+            request.urlsafe_game_key, version, request.page_size or '',
+            request.cursor or '')
+        forms = get_cached_response(cache_key, GameHistoryForms)
+        if forms is not None:
+            return forms
         
-        game_key = ndb.Key(Game, request.urlsafe_game_key)
-        return GameHistoryForms(items=[game_history.to_form()
-                                       for game_history in
-                                       GameHistory.query(ancestor=game_key).order(GameHistory.date_created)]
-                                )
+        # Games with an inline move log need no query
+        if game.history_inline:
+            items, next_cursor = slice_page(game.inline_history_forms(),
+                                            request.page_size, request.cursor)
+        else:
+            history, next_cursor = fetch_page(game.history_query(),
+                                              request.page_size, request.cursor)
+            items = [game_history.to_form() for game_history in history]
+        forms = GameHistoryForms(items=items, next_cursor=next_cursor,
+                                 version=version)
+        cache_response(cache_key, forms, final=game.game_over)
+        return forms
+    
+    @endpoints.method(request_message=GET_HINT,
+                      response_message=HintForm,
+                      path='game/{urlsafe_game_key}/hint',
+                      name='get_hint',
+                      http_method='GET')
+    @instrumented
+    def get_hint(self, request):
+        """Return the dictionary words that still match the game and the
+        untried letter found in most of them"""
+        game = get_by_urlsafe(request.urlsafe_game_key, Game)
+        if not game:
+            raise endpoints.NotFoundException('Game not found!')
+        count, candidates, best_letter = hints.get_engine().hint(
+            game.word_in_progress, game.get_guessed_letters(),
+            request.number_of_results or HINT_CANDIDATES)
+        return HintForm(candidates_count=count, candidates=candidates,
+                        best_letter=best_letter)
     
     @endpoints.method(request_message=GET_GAME_REQUEST,
                       response_message=StringMessage,
                       path='game/{urlsafe_game_key}',
                       name='cancel_game',
                       http_method='POST')
+    @instrumented
     def cancel_game(self, request):
         """Cancel game API."""
-        game = get_by_urlsafe(request.urlsafe_game_key, Game)
-        if game and game.game_over == False and game.canceled == False:
-            game.canceled = True;
-            game.end_game(False)
-            game.put()
-        else:
-            raise endpoints.NotFoundException('Game not found!')
+        game_key = key_from_urlsafe(request.urlsafe_game_key, Game)
         
+        @ndb.transactional(xg=True, retries=MOVE_RETRIES)
+        def cancel():
+            game = game_key.get()
+            if game and game.game_over == False and game.canceled == False:
+                game.canceled = True;
+                attempts_before = game.attempts_remaining
+                score = game.finish_game(False)
+                ndb.put_multi([game, score, UserStats.add_score(score)])
+                return game, score, attempts_before
+            else:
+                raise endpoints.NotFoundException('Game not found!')
+        
+        try:
+            game, score, attempts_before = cancel()
+        except datastore_errors.TransactionFailedError:
+            raise endpoints.ConflictException(GAME_CONTENTION_MESSAGE)
+        wait_after_commit(
+            [counters.game_changed_async(game, True, attempts_before),
+             Leaderboard.record_score_async(score)], 'canceling a game')
         return StringMessage(message="Game canceled")
     
     @endpoints.method(request_message=GET_USER_GAME,
@@ -138,75 +310,126 @@ class HangmanApi(remote.Service):
                       path='user_games',
                       name='get_user_games',
                       http_method='POST')
+    @instrumented
     def get_user_games(self, request):
         """Get user active games"""
-        user = User.query(User.name == request.user_name).get()
+        user = User.get_by_name(request.user_name)
         if not user:
             raise endpoints.NotFoundException(
                 'User not found')
-        ancestor_key = ndb.Key(User, user.name)
+        ancestor_key = user.key
         # Get user games that are still active
-        return GameForms(items=[game.to_form('Game online')
-                                for game in Game.query(ancestor=ancestor_key).filter(
-                Game.game_over == False, Game.canceled == False)])
+        games, next_cursor = fetch_page(
+            Game.query(ancestor=ancestor_key).filter(
+                Game.game_over == False, Game.canceled == False),
+            request.page_size, request.cursor)
+        return GameForms(items=[game.to_form('Game online') for game in games],
+                         next_cursor=next_cursor)
     
     @endpoints.method(request_message=MAKE_MOVE_REQUEST,
                       response_message=GameForm,
                       path='game/{urlsafe_game_key}',
                       name='make_move',
                       http_method='PUT')
+    @instrumented
     def make_move(self, request):
         """Makes a move. Returns a game state with message"""
-        game = get_by_urlsafe(request.urlsafe_game_key, Game)
-        # Check if the game is finished
-        if game.game_over:
-            return game.to_form('Game already finished!')
-        
-        # Only alphabetic character is allowed
-        if not request.guess.isalpha():
-            return game.to_form('Only alphabetic character is allowed!')
-        guess = request.guess.upper()
-        
-        # Only one character is allowed
-        if len(guess) != 1:
-            return game.to_form('Only one character allowed')
-        
-        # We will check if the character is already used
-        game_key = ndb.Key(Game, request.urlsafe_game_key)
-        ls = GameHistory.query(ancestor=game_key).filter(
-            GameHistory.guess == guess).count()
-        if ls != 0:
-            return game.to_form('Character already used' + guess)
-        
-        found = False
-        temp = list(game.guess_word)
-        temp_wimp = list(game.word_in_progress)
-        for i, val in enumerate(temp):
-            if val == guess:
-                temp_wimp[i] = guess
-                found = True
-                msg = 'Key found ' + guess
-                GameHistory.create_game_history(request.urlsafe_game_key, guess, found, i, 'Found')
-        
-        game.word_in_progress = ''.join(temp_wimp)
-        
-        if found is False:
-            GameHistory.create_game_history(request.urlsafe_game_key, guess, found, -1, 'Not found')
-            game.attempts_remaining -= 1
-            msg = 'Character not found in word: ' + request.guess
-        
-        if game.word_in_progress == game.guess_word:
-            game.end_game(True)
-            msg = 'You win'
-        
-        if game.attempts_remaining < 1:
-            game.end_game(False)
-            GameHistory.create_game_history(request.urlsafe_game_key,
-                                            guess, found, -1, 'Not attempts remaining you lose')
-            return game.to_form(msg + ' Game over!')
-        else:
-            game.put()
-            return game.to_form(msg)
+        try:
+            game, results = play_guesses(request.urlsafe_game_key,
+                                         [request.guess])
+        except datastore_errors.TransactionFailedError:
+            raise endpoints.ConflictException(GAME_CONTENTION_MESSAGE)
+        return game.to_form(results[0][1])
+    
+    @endpoints.method(request_message=MAKE_MOVES_REQUEST,
+                      response_message=MakeMovesResultForm,
+                      path='game/{urlsafe_game_key}/moves',
+                      name='make_moves',
+                      http_method='PUT')
+    @instrumented
+    def make_moves(self, request):
+        """Makes several moves in order, stopping when the game is over.
+        Returns the result of each move and the final game state"""
+        if len(request.guesses) > MAX_MOVES:
+            raise endpoints.BadRequestException(
+                'At most {} guesses per request'.format(MAX_MOVES))
+        try:
+            game, results = play_guesses(request.urlsafe_game_key,
+                                         request.guesses)
+        except datastore_errors.TransactionFailedError:
+            raise endpoints.ConflictException(GAME_CONTENTION_MESSAGE)
+        msg = results[-1][1] if results else 'No guesses given'
+        return MakeMovesResultForm(
+            results=[MoveResultForm(guess=guess, message=message)
+                     for guess, message in results],
+            game=game.to_form(msg))
+
+
+def play_guesses(urlsafe_game_key, guesses):
+    """Applies the guesses in order to the game in one transaction, stopping
+    once the game is over. The transaction is retried MOVE_RETRIES times when
+    another request updates the game at the same time, then
+    TransactionFailedError is raised. Once committed, the active game
+    counters and, if the game ended, the leaderboards are updated in
+    parallel; their failures are only logged, the moves being saved.
+    Returns:
+        The updated game and a list of (guess, message) pairs."""
+    game_key = key_from_urlsafe(urlsafe_game_key, Game)
+    
+    @ndb.transactional(xg=True, retries=MOVE_RETRIES)
+    def play():
+        game = game_key.get()
+        if not game:
+            raise endpoints.NotFoundException('Game not found!')
+        was_active = not game.game_over
+        attempts_before = game.attempts_remaining
+        letters_before = game.guessed_letters
+        results = []
+        to_put = []
+        score = None
+        for guess in guesses:
+            if game.game_over and results:
+                break
+            msg, entities, move_score = apply_guess(game, guess)
+            results.append((guess, msg))
+            to_put.extend(entities)
+            score = score or move_score
+        # Every entity changed by the moves is written in a single batch
+        if game.guessed_letters != letters_before:
+            ndb.put_multi([game] + to_put)
+        return game, results, score, was_active, attempts_before
+    
+    game, results, score, was_active, attempts_before = play()
+    futures = [counters.game_changed_async(game, was_active, attempts_before)]
+    if score:
+        futures.append(Leaderboard.record_score_async(score))
+    wait_after_commit(futures, 'a move')
+    return game, results
+
+
+def apply_guess(game, guess):
+    """Applies one guess to the game with the rules engine. Returns the
+    message for the player, the unsaved GameHistory, Score and UserStats
+    entities created by the move and the Score if the move ended the game.
+    Must run in the transaction that writes them. The game
+    itself is changed in place; a guess that is rejected leaves it
+    unchanged."""
+    state = game.to_state()
+    result = state.guess(guess)
+    if not result.accepted:
+        return result.message, [], None
+    
+    game.update_from_state(state)
+    to_put = []
+    for event in result.events:
+        history = game.add_history(*event)
+        if history:
+            to_put.append(history)
+    score = None
+    if state.game_over:
+        score = game.finish_game(state.won)
+        to_put.extend([score, UserStats.add_score(score)])
+    return result.message, to_put, score
 
 
 @endpoints.api(name='guess_a_number', version='v1')
@@ -219,11 +442,10 @@ class GuessANumberApi(remote.Service):
                       http_method='POST')
     def create_user(self, request):
         """Create a User. Requires a unique username"""
-        if User.query(User.name == request.user_name).get():
+        if User.get_by_name(request.user_name):
             raise endpoints.ConflictException(
                 'A User with that name already exists!')
-        user = User(name=request.user_name, email=request.email)
-        user.put()
+        User.create_user(request.user_name, request.email)
         # Return the confirmation of user created
         return StringMessage(message='User {} created!'.format(
             request.user_name))
@@ -235,7 +457,7 @@ class GuessANumberApi(remote.Service):
                       http_method='POST')
     def new_game(self, request):
         """Creates new game"""
-        user = User.query(User.name == request.user_name).get()
+        user = User.get_by_name(request.user_name)
         if not user:
             raise endpoints.NotFoundException(
                 'A User with that name does not exist!')
@@ -272,7 +494,7 @@ class GuessANumberApi(remote.Service):
                       http_method='PUT')
     def make_move(self, request):
         """Makes a move. Returns a game state with message"""
-        game = get_by_urlsafe(request.urlsafe_game_key, Game)
+        game = get_by_urlsafe(request.urlsafe_game_key, Game, use_cache=False)
         if game.game_over:
             return game.to_form('Game already over!')
         
@@ -293,27 +515,31 @@ class GuessANumberApi(remote.Service):
             game.put()
             return game.to_form(msg)
     
-    @endpoints.method(response_message=ScoreForms,
+    @endpoints.method(request_message=GET_SCORES,
+                      response_message=ScoreForms,
                       path='scores',
                       name='get_scores',
                       http_method='GET')
     def get_scores(self, request):
-        """Return all scores"""
-        return ScoreForms(items=[score.to_form() for score in Score.query()])
+        """Return all scores, one page at a time"""
+        scores, next_cursor = fetch_page(Score.query(), request.page_size,
+                                         request.cursor)
+        return Score.to_forms(scores, next_cursor)
     
-    @endpoints.method(request_message=USER_REQUEST,
+    @endpoints.method(request_message=GET_USER_SCORES,
                       response_message=ScoreForms,
                       path='scores/user/{user_name}',
                       name='get_user_scores',
                       http_method='GET')
     def get_user_scores(self, request):
         """Returns all of an individual User's scores"""
-        user = User.query(User.name == request.user_name).get()
+        user = User.get_by_name(request.user_name)
         if not user:
             raise endpoints.NotFoundException(
                 'A User with that name does not exist!')
-        scores = Score.query(Score.user == user.key)
-        return ScoreForms(items=[score.to_form() for score in scores])
+        scores, next_cursor = fetch_page(Score.query(Score.user == user.key),
+                                         request.page_size, request.cursor)
+        return Score.to_forms(scores, next_cursor)
     
     @endpoints.method(response_message=StringMessage,
                       path='games/average_attempts',
@@ -321,19 +547,15 @@ class GuessANumberApi(remote.Service):
                       http_method='GET')
     def get_average_attempts(self, request):
         """Get the cached average moves remaining"""
-        return StringMessage(message=memcache.get(MEMCACHE_MOVES_REMAINING) or '')
+        message = memcache.get(MEMCACHE_MOVES_REMAINING)
+        if message is None:
+            message = GuessANumberApi._cache_average_attempts()
+        return StringMessage(message=message or '')
     
     @staticmethod
     def _cache_average_attempts():
-        """Populates memcache with the average moves remaining of Games"""
-        games = Game.query(Game.game_over == False).fetch()
-        if games:
-            count = len(games)
-            total_attempts_remaining = sum([game.attempts_remaining
-                                            for game in games])
-            average = float(total_attempts_remaining) / count
-            memcache.set(MEMCACHE_MOVES_REMAINING,
-                         'The average moves remaining is {:.2f}'.format(average))
-
+        """Populates memcache with the average moves remaining of Games,
+        computed from the sharded active game counters"""
+        return counters.cache_average_attempts()
 
 api = endpoints.api_server([HangmanApi])
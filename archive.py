@@ -0,0 +1,132 @@
+"""archive.py - Archival and purge of finished games and old scores.
+
+Finished (and canceled) games created before a cutoff, with their
+GameHistory entities, and scores dated before it are read in keys-only
+cursor batches. Each batch is written as one gzipped newline-delimited JSON
+file, then deleted. A batch only deletes the entities it has just written,
+so a run interrupted at any point can be resumed from its last cursor; a
+retried batch writes a new file, so an entity may be archived twice but
+never lost. Readers should dedupe on the 'key' field.
+
+Files go to the Cloud Storage bucket named by ARCHIVE_BUCKET when the
+cloudstorage client library is deployed, otherwise to ArchiveBatch
+entities.
+"""
+
+import datetime
+import gzip
+import json
+import os
+from cStringIO import StringIO
+from google.appengine.ext import ndb
+from models import Game, GameHistory, Score
+
+try:
+    import cloudstorage
+except ImportError:
+    cloudstorage = None
+
+# Games or scores read by one batch
+ARCHIVE_BATCH_SIZE = 200
+ARCHIVE_BUCKET = os.environ.get('ARCHIVE_BUCKET')
+# Finished games and scores older than this many days are archived
+ARCHIVE_AGE_DAYS = int(os.environ.get('ARCHIVE_AGE_DAYS', '90'))
+KINDS = ('Game', 'Score')
+
+
+class ArchiveBatch(ndb.Model):
+    """One archive file, used when no Cloud Storage bucket is configured"""
+    count = ndb.IntegerProperty(indexed=False)
+    # Gzipped newline-delimited JSON, one entity per line
+    data = ndb.BlobProperty()
+    date_created = ndb.DateTimeProperty(auto_now_add=True)
+
+
+def _json_default(value):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    if isinstance(value, ndb.Key):
+        return value.urlsafe()
+    raise TypeError('{!r} is not JSON serializable'.format(value))
+
+
+def entity_row(entity):
+    """Returns the archived dict of an entity"""
+    row = entity.to_dict()
+    row['key'] = entity.key.urlsafe()
+    return row
+
+
+def compress(rows):
+    """Returns the rows as gzipped newline-delimited JSON"""
+    buf = StringIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb') as output:
+        for row in rows:
+            output.write(json.dumps(row, default=_json_default,
+                                    separators=(',', ':')))
+            output.write('\n')
+    return buf.getvalue()
+
+
+def write_file(name, data, count):
+    """Writes one archive file"""
+    if cloudstorage is not None and ARCHIVE_BUCKET:
+        path = '/{}/{}'.format(ARCHIVE_BUCKET, name)
+        with cloudstorage.open(path, 'w',
+                               content_type='application/gzip') as output:
+            output.write(data)
+    else:
+        ArchiveBatch(id=name, count=count, data=data).put()
+
+
+def query(kind, cutoff):
+    """Returns the query of the entities of kind to archive"""
+    if kind == 'Game':
+        return Game.query(Game.game_over == True, Game.date_created < cutoff)
+    if kind == 'Score':
+        return Score.query(Score.date < cutoff.date())
+    raise ValueError('Unknown kind {}'.format(kind))
+
+
+def game_rows(keys):
+    """Returns the rows of the games, each with its moves, and the keys of
+    the games and GameHistory entities they hold"""
+    games = [game for game in ndb.get_multi(keys) if game]
+    futures = dict(
+        (game.key, GameHistory.query(
+            ancestor=ndb.Key(Game, game.key.urlsafe())).order(
+            GameHistory.date_created).fetch_async())
+        for game in games if not game.history_inline)
+    rows = []
+    to_delete = []
+    for game in games:
+        row = entity_row(game)
+        history = futures[game.key].get_result() \
+            if game.key in futures else []
+        row['history'] = [entity_row(entry) for entry in history]
+        rows.append(row)
+        to_delete.append(game.key)
+        to_delete.extend(entry.key for entry in history)
+    return rows, to_delete
+
+
+def archive_batch(kind, cutoff, name, cursor=None):
+    """Archives and deletes one batch of entities of kind. Returns the number
+    of entities deleted, the next cursor and whether there may be more."""
+    keys, cursor, more = query(kind, cutoff).fetch_page(
+        ARCHIVE_BATCH_SIZE, start_cursor=cursor, keys_only=True)
+    if kind == 'Game':
+        rows, to_delete = game_rows(keys)
+    else:
+        scores = [score for score in ndb.get_multi(keys) if score]
+        rows = [entity_row(score) for score in scores]
+        to_delete = [score.key for score in scores]
+    if rows:
+        write_file(name, compress(rows), len(rows))
+        ndb.delete_multi(to_delete)
+    return len(to_delete), cursor, more
+
+
+def default_cutoff():
+    return datetime.datetime.utcnow() - \
+        datetime.timedelta(days=ARCHIVE_AGE_DAYS)
@@ -0,0 +1,95 @@
+"""bench_contention.py - Load test of concurrent moves on a single game.
+
+Several threads play the same game at once through HangmanApi.make_move
+against the App Engine testbed stubs. A move answered with a conflict is
+sent again. The throughput and the number of conflicts are reported for
+each level of concurrency; the consistency of the final game is checked by
+tests/test_contention.py.
+
+    python benchmarks/bench_contention.py [--threads 1,2,4,8,16] [--games 5]
+
+Runs on the testbed of stubs.py, which requires the App Engine SDK.
+"""
+
+import argparse
+import os
+import string
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import endpoints
+
+import stubs
+
+WORD = 'RELATIONSHIP'
+
+
+def play(api, request_class, urlsafe_key, letters, stats, lock):
+    """Sends the letters in order, sending a move again on conflict"""
+    for letter in letters:
+        while True:
+            request = request_class(urlsafe_game_key=urlsafe_key, guess=letter)
+            try:
+                api.make_move(request)
+            except endpoints.ConflictException:
+                with lock:
+                    stats['conflicts'] += 1
+                continue
+            break
+        with lock:
+            stats['moves'] += 1
+
+
+def run_level(threads, games):
+    from api import HangmanApi, MAKE_MOVE_REQUEST
+    from models import Game, User
+    api = HangmanApi()
+    request_class = MAKE_MOVE_REQUEST.combined_message_class
+    user = User.create_user('bench', None)
+    stats = {'moves': 0, 'conflicts': 0}
+    lock = threading.Lock()
+    elapsed = 0.0
+    for _ in range(games):
+        game = Game(parent=user.key, user=user.key, guess_word=WORD,
+                    word_in_progress='_' * len(WORD),
+                    guessed_letters='', attempts_allowed=26,
+                    attempts_remaining=26)
+        game.put()
+        urlsafe_key = game.key.urlsafe()
+        workers = [threading.Thread(
+            target=play,
+            args=(api, request_class, urlsafe_key,
+                  string.ascii_uppercase[i::threads], stats, lock))
+            for i in range(threads)]
+        start = time.time()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed += time.time() - start
+    return stats['moves'] / elapsed, stats['conflicts']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--threads', default='1,2,4,8,16',
+                        help='comma separated levels of concurrency')
+    parser.add_argument('--games', type=int, default=5,
+                        help='games played at each level')
+    args = parser.parse_args()
+
+    print('threads  moves/s  conflicts')
+    for threads in [int(level) for level in args.threads.split(',')]:
+        bed = stubs.setup_testbed()
+        try:
+            throughput, conflicts = run_level(threads, args.games)
+        finally:
+            bed.deactivate()
+        print('{:7d}  {:7.1f}  {:9d}'.format(threads, throughput, conflicts))
+
+
+if __name__ == '__main__':
+    main()
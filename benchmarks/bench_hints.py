@@ -0,0 +1,75 @@
+"""bench_hints.py - Benchmark of the hint engine (hints.py).
+
+For synthetic dictionaries of several sizes, reports the time to build the
+bitset index of one word length and the latency of a hint (candidate
+filtering plus best letter) for patterns with more or fewer letters
+revealed. The hint cache is cleared before every timed hint.
+
+    python benchmarks/bench_hints.py [--sizes 10000,100000,500000]
+"""
+
+import argparse
+import os
+import random
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import hints
+import words
+
+# Letter weights of English text, so the synthetic words share letters
+WEIGHTS = dict(zip(string.ascii_uppercase,
+                   [82, 15, 28, 43, 127, 22, 20, 61, 70, 2, 8, 40, 24, 67,
+                    75, 19, 1, 60, 63, 91, 28, 10, 24, 2, 20, 1]))
+LENGTH = 8
+
+
+def synthetic_words(count, rng):
+    letters = ''.join(letter * weight for letter, weight in WEIGHTS.items())
+    return [''.join(rng.choice(letters) for _ in range(rng.randint(4, 12)))
+            for _ in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', default='10000,100000,500000',
+                        help='comma separated dictionary sizes')
+    parser.add_argument('--hints', type=int, default=200,
+                        help='hints timed per pattern kind')
+    args = parser.parse_args()
+    rng = random.Random(0)
+
+    print('words   length-{} words  build s  hint ms (0 / 2 / 4 revealed)'
+          .format(LENGTH))
+    for size in [int(value) for value in args.sizes.split(',')]:
+        index = words.WordIndex(words.build_index(synthetic_words(size, rng)))
+        engine = hints.HintEngine(index)
+        start = time.time()
+        length_index = engine.length_index(LENGTH)
+        build = time.time() - start
+
+        timings = []
+        for revealed in (0, 2, 4):
+            elapsed = 0.0
+            for _ in range(args.hints):
+                word = index.random_word(length=LENGTH)
+                shown = set(rng.sample(sorted(set(word)),
+                                       min(revealed, len(set(word)))))
+                pattern = ''.join(char if char in shown else hints.BLANK
+                                  for char in word)
+                missed = [letter for letter in 'ETAOINSHRDLU'
+                          if letter not in word][:2]
+                # Time the filtering, not the hint cache
+                engine.clear_cache()
+                start = time.time()
+                engine.hint(pattern, ''.join(shown) + ''.join(missed))
+                elapsed += time.time() - start
+            timings.append(elapsed * 1000 / args.hints)
+        print('{:7d}  {:13d}  {:7.2f}  {:6.3f} / {:6.3f} / {:6.3f}'.format(
+            size, length_index.size, build, *timings))
+
+
+if __name__ == '__main__':
+    main()
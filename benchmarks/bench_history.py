@@ -0,0 +1,87 @@
+"""bench_history.py - Compares the two game history storage modes.
+
+Plays the same games with the moves stored as GameHistory entities
+('entity') and as the packed move log on the Game ('inline'), on the App
+Engine testbed stubs. Reports the stored bytes and entities of each mode and
+the latency of reading the whole history with get_game_history.
+
+    python benchmarks/bench_history.py [--games 200] [--reads 5]
+
+Runs on the testbed of stubs.py, which requires the App Engine SDK.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from google.appengine.api import memcache
+
+import stubs
+
+WORDS = ['HANGMAN', 'PYTHON', 'GRANDMOTHER', 'RELATIONSHIP', 'PRESIDENT']
+GUESSES = 'ESIARNTOLCDUGPMHBYFVKWZXQJ'
+
+
+def run_mode(mode, games, reads):
+    import models
+    import utils
+    from api import HangmanApi, MAKE_MOVES_REQUEST, GET_GAME_HISTORY
+    from models import Game, GameHistory, User
+    models.HISTORY_MODE = mode
+    api = HangmanApi()
+    user = User.create_user('bench', None)
+    keys = []
+    for i in range(games):
+        word = WORDS[i % len(WORDS)]
+        game = Game(parent=user.key, user=user.key, guess_word=word,
+                    word_in_progress='_' * len(word),
+                    guessed_letters='', history_inline=mode == 'inline')
+        game.put()
+        keys.append(game.key.urlsafe())
+        api.make_moves(MAKE_MOVES_REQUEST.combined_message_class(
+            urlsafe_game_key=keys[-1], guesses=list(GUESSES)))
+
+    entities = Game.query().fetch() + GameHistory.query().fetch()
+    size = sum(len(entity._to_pb().Encode()) for entity in entities)
+
+    latencies = []
+    request_class = GET_GAME_HISTORY.combined_message_class
+    for _ in range(reads):
+        # Measure the datastore path, not the entity cache
+        utils.entity_cache.clear()
+        memcache.flush_all()
+        for key in keys:
+            start = time.time()
+            api.get_game_history(request_class(urlsafe_game_key=key,
+                                               page_size=100))
+            latencies.append((time.time() - start) * 1000)
+    latencies.sort()
+    return {'entities': len(entities), 'bytes': size,
+            'p50_ms': latencies[len(latencies) // 2],
+            'p95_ms': latencies[int(len(latencies) * 0.95)]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--games', type=int, default=200)
+    parser.add_argument('--reads', type=int, default=5,
+                        help='reads of the history of every game')
+    args = parser.parse_args()
+
+    print('mode    entities      bytes  read p50 ms  read p95 ms')
+    for mode in ('entity', 'inline'):
+        bed = stubs.setup_testbed()
+        try:
+            result = run_mode(mode, args.games, args.reads)
+        finally:
+            bed.deactivate()
+        print('{:6}  {:8d}  {:9d}  {:11.3f}  {:11.3f}'.format(
+            mode, result['entities'], result['bytes'], result['p50_ms'],
+            result['p95_ms']))
+
+
+if __name__ == '__main__':
+    main()
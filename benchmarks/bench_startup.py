@@ -0,0 +1,86 @@
+"""bench_startup.py - Import time of each module on a cold interpreter.
+
+Every module is imported in a fresh Python process, as on a new instance,
+and the time of the import and the number of modules it loads are
+reported, best of --runs. The warmup work of main.Warmup that needs no
+datastore (loading the word index and building its hint indexes) is timed
+the same way.
+
+    python benchmarks/bench_startup.py [--runs 5] [--modules main,api]
+
+Modules that need the App Engine SDK are reported as unavailable when it is
+not on the Python path.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODULES = ('rules', 'words', 'hints', 'counters', 'utils', 'models',
+           'reminders', 'instrumentation', 'archive', 'main', 'api')
+
+IMPORT_SCRIPT = """
+import json, sys, time
+sys.path.insert(0, %(root)r)
+before = len(sys.modules)
+start = time.time()
+try:
+    __import__(%(module)r)
+except ImportError as e:
+    print(json.dumps({'error': str(e)}))
+else:
+    print(json.dumps({'seconds': time.time() - start,
+                      'modules': len(sys.modules) - before}))
+"""
+
+WARMUP_SCRIPT = """
+import json, sys, time
+sys.path.insert(0, %(root)r)
+import hints, words
+start = time.time()
+index = words.get_index()
+engine = hints.get_engine()
+for length in sorted(set(bucket[0] for bucket in index.buckets())):
+    engine.length_index(length)
+print(json.dumps({'seconds': time.time() - start, 'modules': 0}))
+"""
+
+
+def measure(script, runs):
+    """Returns the best result of running script in runs fresh processes"""
+    best = None
+    for _ in range(runs):
+        output = subprocess.check_output([sys.executable, '-c', script])
+        result = json.loads(output.strip().splitlines()[-1])
+        if 'error' in result:
+            return result
+        if best is None or result['seconds'] < best['seconds']:
+            best = result
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--modules', default=','.join(MODULES),
+                        help='comma separated modules to import')
+    args = parser.parse_args()
+
+    print('{:<16}  {:>8}  {:>7}'.format('module', 'ms', 'modules'))
+    for module in args.modules.split(','):
+        result = measure(IMPORT_SCRIPT % {'root': ROOT, 'module': module},
+                         args.runs)
+        if 'error' in result:
+            print('{:<16}  unavailable ({})'.format(module, result['error']))
+        else:
+            print('{:<16}  {:8.1f}  {:7d}'.format(
+                module, 1000 * result['seconds'], result['modules']))
+    result = measure(WARMUP_SCRIPT % {'root': ROOT}, args.runs)
+    print('{:<16}  {:8.1f}'.format('warmup (words)', 1000 * result['seconds']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""bench_words.py - Benchmark of the word dictionary engine (words.py).
+
+Builds a synthetic dictionary (or packs a given word list), then reports the
+load time, the resident memory added by loading it and the random word
+selection throughput.
+
+    python benchmarks/bench_words.py [--words 500000] [--word-list FILE]
+"""
+
+import argparse
+import os
+import random
+import resource
+import string
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import words
+
+
+def rss_kb():
+    """Current resident memory of the process in KB. Falls back to the peak
+    value where /proc is not available."""
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except IOError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def synthetic_words(count, seed=0):
+    rng = random.Random(seed)
+    return [''.join(rng.choice(string.ascii_uppercase)
+                    for _ in range(rng.randint(3, 14)))
+            for _ in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--words', type=int, default=500000,
+                        help='size of the synthetic dictionary')
+    parser.add_argument('--word-list', help='pack this word list instead')
+    parser.add_argument('--selections', type=int, default=200000)
+    args = parser.parse_args()
+
+    if args.word_list:
+        with open(args.word_list) as source:
+            packed = words.build_index(source)
+    else:
+        packed = words.build_index(synthetic_words(args.words))
+    fd, path = tempfile.mkstemp(suffix='.dat')
+    with os.fdopen(fd, 'wb') as output:
+        output.write(packed)
+    del packed
+
+    rss_before = rss_kb()
+    start = time.time()
+    index = words.load(path)
+    load_time = time.time() - start
+    rss_after = rss_kb()
+
+    print('dictionary: {} words, {} bytes on disk'.format(
+        len(index), os.path.getsize(path)))
+    print('load time: {:.3f} ms'.format(load_time * 1000))
+    print('resident memory added by load: {} KB'.format(rss_after - rss_before))
+
+    filters = [(None, None, None), ('easy', None, None),
+               ('medium', None, None), ('hard', None, None),
+               (None, 7, None), (None, 8, 6)]
+    for difficulty, length, letters in filters:
+        if not index.count(difficulty, length, letters):
+            continue
+        start = time.time()
+        for _ in range(args.selections):
+            index.random_word(difficulty, length, letters)
+        elapsed = time.time() - start
+        print('random_word(difficulty={}, length={}, letters={}): '
+              '{:.0f} words/s'.format(difficulty, length, letters,
+                                      args.selections / elapsed))
+    print('resident memory added after selections: {} KB'.format(
+        rss_kb() - rss_before))
+    os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,246 @@
+"""replay.py - Offline load-replay benchmark of the Hangman API.
+
+Replays a workload against HangmanApi in-process, on the App Engine testbed
+stubs (datastore, memcache, task queue), so no network is needed. For every
+endpoint it reports the p50/p95/p99 latency, the API RPCs made per service
+and call, the datastore entities read and written, and the error responses
+(endpoints.ServiceException); any other exception stops the replay. The
+report is saved as JSON with sorted keys so two runs can be diffed in
+review.
+
+The stubs answer at once, so the latency measured here is mostly CPU. The
+report also gives the critical path of each call in RPC rounds: RPCs that
+run in parallel, such as the futures of a tasklet, share a round. With
+--rpc-ms it estimates the time spent waiting on RPCs when they run one
+after another and on the critical path, as they run now.
+
+A workload is a JSON lines file with one API call per line:
+
+    {"method": "create_user", "params": {"user_name": "u1"}}
+    {"method": "create_game", "params": {"user_name": "u1"}, "game": "g1"}
+    {"method": "make_move", "params": {"guess": "E"}, "game": "g1"}
+    {"method": "get_game_history", "params": {}, "game": "g1"}
+
+"game" names a game: on create_game the name is bound to the new game, on
+the other methods it fills in urlsafe_game_key.
+
+    python benchmarks/replay.py --workload requests.jsonl --output run.json
+    python benchmarks/replay.py --synthetic 200 --output run.json
+
+Runs on the testbed of stubs.py, which requires the App Engine SDK.
+"""
+
+import argparse
+import collections
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import endpoints
+from google.appengine.api import apiproxy_stub_map
+
+import stubs
+
+# Guess order used by the synthetic players
+LETTER_FREQUENCY = 'ESIARNTOLCDUGPMHBYFVKWZXQJ'
+
+
+class RpcCounter(object):
+    """Counts the API calls made while it is active, with post-call hooks,
+    and the rounds of the critical path. An RPC started after RPCs of round
+    n completed is in round n + 1."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.calls = collections.Counter()
+        self.entities_read = 0
+        self.entities_written = 0
+        self.rounds = 0
+        self._completed_round = 0
+        self._started = {}
+
+    def install(self):
+        apiproxy_stub_map.apiproxy.GetPreCallHooks().Append(
+            'replay_rpc_rounds', self.start_hook)
+        apiproxy_stub_map.apiproxy.GetPostCallHooks().Append(
+            'replay_rpc_counter', self.hook)
+
+    def start_hook(self, service, call, request, response):
+        rpc_round = self._completed_round + 1
+        self._started[id(request)] = rpc_round
+        self.rounds = max(self.rounds, rpc_round)
+
+    def hook(self, service, call, request, response):
+        rpc_round = self._started.pop(id(request), self._completed_round + 1)
+        self._completed_round = max(self._completed_round, rpc_round)
+        self.calls['{}.{}'.format(service, call)] += 1
+        if service != 'datastore_v3':
+            return
+        if call == 'Get':
+            self.entities_read += sum(1 for result in response.entity_list()
+                                      if result.has_entity())
+        elif call in ('RunQuery', 'Next'):
+            self.entities_read += response.result_size()
+        elif call == 'Put':
+            self.entities_written += request.entity_size()
+        elif call == 'Delete':
+            self.entities_written += request.key_size()
+
+
+def synthetic_workload(players, seed=0):
+    """Each player signs up, starts a game, plays it to the end in bursts of
+    moves, and reads its history and the scores"""
+    rng = random.Random(seed)
+    calls = []
+    for i in range(players):
+        user = 'player{}'.format(i)
+        game = 'game{}'.format(i)
+        calls.append({'method': 'create_user',
+                      'params': {'user_name': user,
+                                 'email': '{}@example.com'.format(user)}})
+        calls.append({'method': 'create_game',
+                      'params': {'user_name': user}, 'game': game})
+        # Mostly frequency order, with some variety between players
+        rare = list(LETTER_FREQUENCY[6:])
+        rng.shuffle(rare)
+        for letter in LETTER_FREQUENCY[:6] + ''.join(rare):
+            calls.append({'method': 'make_move',
+                          'params': {'guess': letter}, 'game': game})
+            if rng.random() < 0.2:
+                calls.append({'method': 'get_game_history',
+                              'params': {}, 'game': game})
+        calls.append({'method': 'get_game_history',
+                      'params': {}, 'game': game})
+        calls.append({'method': 'get_user_games',
+                      'params': {'user_name': user}})
+        calls.append({'method': 'get_game', 'params': {}, 'game': game})
+        calls.append({'method': 'get_high_score',
+                      'params': {'user_name': user, 'number_of_results': 5}})
+        calls.append({'method': 'get_user_stats',
+                      'params': {'user_name': user}})
+        calls.append({'method': 'get_leaderboard',
+                      'params': {'number_of_results': 10}})
+    return calls
+
+
+def read_workload(path):
+    with open(path) as workload:
+        return [json.loads(line) for line in workload if line.strip()]
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a sorted list"""
+    if not values:
+        return 0.0
+    rank = max(int(round(fraction * len(values) + 0.5)) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+def replay(calls, rpc_ms=10.0):
+    """Runs the calls in order and returns the report per endpoint. rpc_ms
+    is the assumed time of one RPC for the estimated RPC wait times."""
+    from api import HangmanApi
+    api = HangmanApi()
+    counter = RpcCounter()
+    counter.install()
+    games = {}
+    latencies = collections.defaultdict(list)
+    rpcs = collections.defaultdict(collections.Counter)
+    entities = collections.defaultdict(lambda: {'read': 0, 'written': 0})
+    rounds = collections.Counter()
+    errors = collections.Counter()
+
+    for call in calls:
+        name = call['method']
+        method = getattr(api, name)
+        params = dict(call.get('params', {}))
+        if call.get('game') and name != 'create_game':
+            params['urlsafe_game_key'] = games.get(call['game'])
+        request = method.remote.request_type(**params)
+
+        counter.reset()
+        start = time.time()
+        # Errors the API answers to the client are counted; anything else
+        # is a bug and stops the replay
+        try:
+            response = method(request)
+        except endpoints.ServiceException:
+            errors[name] += 1
+            response = None
+        latencies[name].append((time.time() - start) * 1000)
+        rpcs[name].update(counter.calls)
+        rounds[name] += counter.rounds
+        entities[name]['read'] += counter.entities_read
+        entities[name]['written'] += counter.entities_written
+        if name == 'create_game' and response is not None:
+            games[call.get('game')] = response.urlsafe_key
+
+    report = {}
+    for name, values in latencies.items():
+        values.sort()
+        count = len(values)
+        rpcs_per_call = float(sum(rpcs[name].values())) / count
+        rounds_per_call = float(rounds[name]) / count
+        report[name] = {
+            'calls': count,
+            'errors': errors[name],
+            'latency_ms': {'p50': round(percentile(values, 0.50), 3),
+                           'p95': round(percentile(values, 0.95), 3),
+                           'p99': round(percentile(values, 0.99), 3)},
+            'rpcs_per_call': dict((rpc, round(float(total) / count, 3))
+                                  for rpc, total in rpcs[name].items()),
+            'rpc_rounds_per_call': round(rounds_per_call, 3),
+            'rpc_wait_ms': {'serial': round(rpcs_per_call * rpc_ms, 3),
+                            'critical_path': round(rounds_per_call * rpc_ms,
+                                                   3)},
+            'entities_read_per_call':
+                round(float(entities[name]['read']) / count, 3),
+            'entities_written_per_call':
+                round(float(entities[name]['written']) / count, 3),
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--workload', help='JSON lines workload to replay')
+    source.add_argument('--synthetic', type=int, metavar='PLAYERS',
+                        help='generate a workload for this many players')
+    parser.add_argument('--save-workload',
+                        help='also write the synthetic workload here')
+    parser.add_argument('--output', help='write the JSON report here')
+    parser.add_argument('--rpc-ms', type=float, default=10.0,
+                        help='assumed time of one RPC in production')
+    args = parser.parse_args()
+
+    if args.workload:
+        calls = read_workload(args.workload)
+    else:
+        calls = synthetic_workload(args.synthetic)
+        if args.save_workload:
+            with open(args.save_workload, 'w') as workload:
+                for call in calls:
+                    workload.write(json.dumps(call, sort_keys=True) + '\n')
+
+    bed = stubs.setup_testbed()
+    try:
+        report = replay(calls, args.rpc_ms)
+    finally:
+        bed.deactivate()
+
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as output:
+            output.write(text + '\n')
+    print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+"""simulate.py - Self-play simulator over the rules engine (rules.py).
+
+Plays many games of GameState across a pool of processes, with no datastore.
+Every game is checked against the invariants of the rules, so the simulator
+doubles as a regression test of rules.py. It reports:
+
+ - the win rate per word length and attempts allowed, to calibrate
+   difficulty;
+ - the games per second per core for each number of processes, to check
+   that it scales close to linearly.
+
+    python benchmarks/simulate.py [--games 1000000] [--processes 1,2,4]
+        [--attempts 6,8,10] [--strategy frequency|hints] [--dictionary FILE]
+
+--dictionary takes a file built with words.py; the default is the deployed
+words.dat, or the built-in words when there is none.
+"""
+
+import argparse
+import collections
+import multiprocessing
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import hints
+import rules
+import words
+
+# English letter frequency order, used by the 'frequency' strategy
+LETTER_FREQUENCY = 'ETAOINSHRDLCUMWFGYPBVKJXQZ'
+
+_index = None
+_engine = None
+
+
+def _setup(dictionary):
+    """Loads the dictionary once per worker process"""
+    global _index, _engine
+    _index = words.load(dictionary) if dictionary else words.get_index()
+    _engine = hints.HintEngine(_index)
+
+
+def check(state, misses):
+    """Returns the invariants of the rules a finished game breaks"""
+    errors = []
+    if not state.game_over:
+        errors.append('game not over after all letters')
+    if state.attempts_remaining < 0:
+        errors.append('negative attempts remaining')
+    if state.attempts_remaining != state.attempts_allowed - misses:
+        errors.append('attempts remaining does not match the misses')
+    if state.won != (state.word_in_progress == state.word):
+        errors.append('won flag does not match the word in progress')
+    if state.won and state.attempts_remaining < 1:
+        errors.append('won without attempts remaining')
+    for shown, char in zip(state.word_in_progress, state.word):
+        if shown != rules.BLANK and shown != char:
+            errors.append('wrong letter revealed')
+            break
+        if shown == rules.BLANK and char in state.guessed_letters:
+            errors.append('guessed letter not revealed')
+            break
+    return errors
+
+
+def play(word, attempts, strategy):
+    """Plays one game. Returns the final state and the number of misses."""
+    state = rules.GameState(word, attempts_allowed=attempts)
+    misses = 0
+    letters = iter(LETTER_FREQUENCY)
+    while not state.game_over:
+        if strategy == 'hints':
+            letter = _engine.hint(state.word_in_progress,
+                                  state.guessed_letters, limit=0)[2]
+            if letter is None:
+                letter = [char for char in LETTER_FREQUENCY
+                          if char not in state.guessed_letters][0]
+        else:
+            letter = next(letters)
+        if not state.guess(letter).accepted:
+            break
+        if letter not in word:
+            misses += 1
+    return state, misses
+
+
+def play_batch(task):
+    """Plays a batch of games in a worker. Returns (length, attempts) ->
+    [games, wins], the broken invariants and the time spent."""
+    seed, games, attempts_choices, strategy = task
+    # random_word draws from the global generator; the attempts come from
+    # a second generator seeded from it, so the two draws are independent
+    random.seed(seed)
+    rng = random.Random(random.getrandbits(64))
+    results = collections.defaultdict(lambda: [0, 0])
+    errors = collections.Counter()
+    start = time.time()
+    for _ in range(games):
+        word = _index.random_word()
+        attempts = rng.choice(attempts_choices)
+        state, misses = play(word, attempts, strategy)
+        result = results[(len(word), attempts)]
+        result[0] += 1
+        result[1] += int(state.won)
+        for error in check(state, misses):
+            errors[error] += 1
+    return dict(results), dict(errors), time.time() - start
+
+
+def run(processes, games, attempts, strategy, dictionary, seed):
+    chunks = processes * 4
+    tasks = [(seed + i, games // chunks + (1 if i < games % chunks else 0),
+              attempts, strategy) for i in range(chunks)]
+    pool = multiprocessing.Pool(processes, _setup, (dictionary,))
+    try:
+        start = time.time()
+        outputs = pool.map(play_batch, tasks)
+        elapsed = time.time() - start
+    finally:
+        pool.close()
+        pool.join()
+    results = collections.defaultdict(lambda: [0, 0])
+    errors = collections.Counter()
+    for batch_results, batch_errors, _ in outputs:
+        for key, (played, won) in batch_results.items():
+            results[key][0] += played
+            results[key][1] += won
+        errors.update(batch_errors)
+    return results, errors, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--games', type=int, default=1000000)
+    parser.add_argument('--processes', default=','.join(
+        str(count) for count in sorted(set([1, 2, multiprocessing.cpu_count()]))),
+        help='comma separated process counts to compare')
+    parser.add_argument('--attempts', default='6,8,10',
+                        help='comma separated attempts allowed to calibrate')
+    parser.add_argument('--strategy', choices=('frequency', 'hints'),
+                        default='frequency')
+    parser.add_argument('--dictionary', help='dictionary file from words.py')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    attempts = [int(value) for value in args.attempts.split(',')]
+
+    print('processes  games/s  games/s/core  efficiency')
+    base = None
+    results = errors = None
+    for processes in [int(value) for value in args.processes.split(',')]:
+        results, errors, elapsed = run(processes, args.games, attempts,
+                                       args.strategy, args.dictionary,
+                                       args.seed)
+        rate = args.games / elapsed
+        per_core = rate / processes
+        base = base or per_core
+        print('{:9d}  {:7.0f}  {:12.0f}  {:9.0f}%'.format(
+            processes, rate, per_core, 100 * per_core / base))
+
+    print('\nwin rate by word length and attempts allowed')
+    print('length  ' + '  '.join('{:>6}'.format(value) for value in attempts))
+    for length in sorted(set(key[0] for key in results)):
+        cells = []
+        for value in attempts:
+            played, won = results.get((length, value), (0, 0))
+            cells.append('{:5.1f}%'.format(100.0 * won / played)
+                         if played else '     -')
+        print('{:6d}  {}'.format(length, '  '.join(cells)))
+
+    if errors:
+        print('\nrule invariants broken:')
+        for error, count in sorted(errors.items()):
+            print('  {}: {}'.format(error, count))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,26 @@
+"""stubs.py - App Engine testbed shared by the benchmarks that run the API.
+
+bench_contention.py, bench_history.py and replay.py call HangmanApi
+in-process on the testbed stubs, so no network or deployed app is needed.
+They require the App Engine SDK (google.appengine, endpoints, protorpc) on
+the Python path.
+"""
+
+from google.appengine.datastore import datastore_stub_util
+from google.appengine.ext import testbed
+
+
+def setup_testbed():
+    """Activates and returns a testbed with the stubs the API uses. Queries
+    are strongly consistent. Deactivate it when done."""
+    bed = testbed.Testbed()
+    bed.activate()
+    # Endpoints reads the app revision from the version id
+    bed.setup_env(current_version_id='testbed.1', overwrite=True)
+    policy = datastore_stub_util.PseudoRandomHRConsistencyPolicy(probability=1)
+    bed.init_datastore_v3_stub(consistency_policy=policy)
+    bed.init_memcache_stub()
+    bed.init_taskqueue_stub()
+    bed.init_app_identity_stub()
+    bed.init_mail_stub()
+    return bed
@@ -0,0 +1,127 @@
+"""counters.py - Sharded counters of the active games and of their total
+attempts remaining. Every change picks one shard at random, so concurrent
+games rarely write the same entity; reading the totals costs one memcache
+get or, on a miss, one batch get of the shards."""
+
+import random
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+NUM_SHARDS = 20
+MEMCACHE_PREFIX = 'GAME_STATS:'
+# Totals cached in memcache are recomputed at least this often (seconds)
+MEMCACHE_TTL = 60
+FIELDS = ('active_games', 'attempts_remaining')
+# Memcache key of the average moves remaining announcement
+AVERAGE_MEMCACHE_KEY = 'MOVES_REMAINING'
+
+
+class GameStatsShard(ndb.Model):
+    """One shard of the active game counters"""
+    active_games = ndb.IntegerProperty(default=0, indexed=False)
+    attempts_remaining = ndb.IntegerProperty(default=0, indexed=False)
+
+
+def shard_keys():
+    return [ndb.Key(GameStatsShard, 'shard-{}'.format(i))
+            for i in range(NUM_SHARDS)]
+
+
+@ndb.transactional_tasklet
+def _add_to_shard_async(key, active_games, attempts_remaining):
+    shard = (yield key.get_async()) or GameStatsShard(key=key)
+    shard.active_games += active_games
+    shard.attempts_remaining += attempts_remaining
+    yield shard.put_async()
+
+
+def add(active_games=0, attempts_remaining=0):
+    """Adds the deltas to a random shard and to the cached totals"""
+    add_async(active_games, attempts_remaining).get_result()
+
+
+@ndb.tasklet
+def add_async(active_games=0, attempts_remaining=0):
+    """Tasklet version of add"""
+    if not (active_games or attempts_remaining):
+        return
+    yield _add_to_shard_async(random.choice(shard_keys()), active_games,
+                              attempts_remaining)
+    # Only updates totals that are cached; missing ones are read from shards
+    yield memcache.Client().offset_multi_async(
+        {'active_games': active_games,
+         'attempts_remaining': attempts_remaining},
+        key_prefix=MEMCACHE_PREFIX)
+
+
+def game_changed(game, was_active, attempts_before):
+    """Updates the counters after a game was written.
+    Args:
+        game: The game as it was written
+        was_active: Whether the game was active before the change
+        attempts_before: Its attempts remaining before the change"""
+    game_changed_async(game, was_active, attempts_before).get_result()
+
+
+def game_changed_async(game, was_active, attempts_before):
+    """Returns a future of game_changed, to overlap it with other calls"""
+    is_active = not game.game_over
+    return add_async(active_games=int(is_active) - int(was_active),
+                     attempts_remaining=(game.attempts_remaining
+                                         if is_active else 0) -
+                     (attempts_before if was_active else 0))
+
+
+def _sum_shards():
+    totals = dict((field, 0) for field in FIELDS)
+    for shard in ndb.get_multi(shard_keys()):
+        if shard:
+            for field in FIELDS:
+                totals[field] += getattr(shard, field)
+    return totals
+
+
+def get_totals():
+    """Returns a dict with the number of active games and their total attempts
+    remaining"""
+    totals = memcache.get_multi(FIELDS, key_prefix=MEMCACHE_PREFIX)
+    if len(totals) == len(FIELDS):
+        return dict((field, int(value)) for field, value in totals.items())
+    totals = _sum_shards()
+    memcache.set_multi(totals, key_prefix=MEMCACHE_PREFIX, time=MEMCACHE_TTL)
+    return totals
+
+
+def cache_average_attempts():
+    """Populates memcache with the average moves remaining of the active
+    games and returns it, or None when there are no active games"""
+    totals = get_totals()
+    if totals['active_games'] > 0:
+        average = float(totals['attempts_remaining']) / totals['active_games']
+        message = 'The average moves remaining is {:.2f}'.format(average)
+        memcache.set(AVERAGE_MEMCACHE_KEY, message, time=MEMCACHE_TTL)
+        return message
+
+
+def reconcile(batch_size=1000):
+    """Recounts the active games with a projection query, one cursor page at
+    a time, and corrects the counters by the drift found. Returns the
+    recounted totals."""
+    # Imported here, models depends on this module
+    from models import Game
+    active_games = 0
+    attempts_remaining = 0
+    cursor = None
+    more = True
+    while more:
+        games, cursor, more = Game.query(Game.game_over == False).fetch_page(
+            batch_size, start_cursor=cursor,
+            projection=[Game.attempts_remaining])
+        active_games += len(games)
+        attempts_remaining += sum(game.attempts_remaining for game in games)
+    current = _sum_shards()
+    add(active_games - current['active_games'],
+        attempts_remaining - current['attempts_remaining'])
+    memcache.delete_multi(FIELDS, key_prefix=MEMCACHE_PREFIX)
+    return {'active_games': active_games,
+            'attempts_remaining': attempts_remaining}
@@ -0,0 +1,198 @@
+"""hints.py - Candidate words and best next letter for a game in progress.
+
+For every word length the dictionary words are numbered, and for every
+position and letter a bitset (a Python int) marks the words having that
+letter at that position. Filtering the candidates of a pattern like '_A__A_'
+is then a few ANDs of bitsets and ranking a letter one popcount, instead of
+a loop over the words. The index of a length is built on first use and kept
+for the life of the instance.
+
+Play games with the solver from the command line:
+
+    python hints.py [--games 100]
+"""
+
+import binascii
+import bisect
+import string
+import threading
+import words
+
+LETTERS = string.ascii_uppercase
+BLANK = '_'
+# Hint results remembered per engine; the opening patterns, which have the
+# most candidates, are shared by many games
+HINT_CACHE_SIZE = 4096
+
+
+def _bits_to_int(bits):
+    """Converts a little endian bytearray bitmap to an int"""
+    return int(binascii.hexlify(bytes(bits[::-1])) or '0', 16)
+
+
+def popcount(bitset):
+    return bin(bitset).count('1')
+
+
+class LengthIndex(object):
+    """Position/letter bitsets of the dictionary words of one length"""
+
+    def __init__(self, index, length):
+        self.length = length
+        self._index = index
+        # Ordinal of the first word of each bucket, and the bucket
+        self._starts = []
+        self._buckets = []
+        count = 0
+        for bucket in index.buckets(length):
+            self._starts.append(count)
+            self._buckets.append(bucket)
+            count += bucket[3]
+        self.size = count
+        self.all = (1 << count) - 1
+
+        positions = [[bytearray((count + 7) // 8) for _ in LETTERS]
+                     for _ in range(length)]
+        for ordinal in range(count):
+            byte, bit = ordinal >> 3, 1 << (ordinal & 7)
+            for position, char in enumerate(self.word(ordinal)):
+                positions[position][ord(char) - 65][byte] |= bit
+        # position -> letter -> bitset of the words
+        self.positions = [[_bits_to_int(bits) for bits in letters]
+                          for letters in positions]
+        # letter -> bitset of the words containing it
+        self.contains = []
+        for letter in range(len(LETTERS)):
+            bitset = 0
+            for position in range(length):
+                bitset |= self.positions[position][letter]
+            self.contains.append(bitset)
+
+    def word(self, ordinal):
+        i = bisect.bisect_right(self._starts, ordinal) - 1
+        word_length, _, offset, _ = self._buckets[i]
+        start = offset + (ordinal - self._starts[i]) * word_length
+        return self._index.data[start:start + word_length]
+
+    def candidates(self, pattern, tried):
+        """Bitset of the words matching the revealed letters of the pattern
+        and having none of the tried letters at a blank position"""
+        result = self.all
+        # Games may hold letters tried before the rules were limited to A-Z
+        excluded = [ord(letter) - 65 for letter in set(tried)
+                    if letter in LETTERS]
+        for position, char in enumerate(pattern):
+            letters = self.positions[position]
+            if char == BLANK:
+                for letter in excluded:
+                    result &= ~letters[letter]
+            else:
+                result &= letters[ord(char) - 65]
+        return result
+
+    def words(self, bitset, limit):
+        """Returns up to limit words of a bitset"""
+        found = []
+        while bitset and len(found) < limit:
+            lowest = bitset & -bitset
+            found.append(self.word(lowest.bit_length() - 1))
+            bitset ^= lowest
+        return found
+
+
+class HintEngine(object):
+    """Hints over a WordIndex, with a LengthIndex built per word length"""
+
+    def __init__(self, index):
+        self._index = index
+        self._lengths = {}
+        self._lock = threading.Lock()
+        self._hints = {}
+
+    def length_index(self, length):
+        length_index = self._lengths.get(length)
+        if length_index is None:
+            with self._lock:
+                length_index = self._lengths.get(length)
+                if length_index is None:
+                    length_index = LengthIndex(self._index, length)
+                    self._lengths[length] = length_index
+        return length_index
+
+    def clear_cache(self):
+        self._hints.clear()
+
+    def hint(self, pattern, tried, limit=20):
+        """Returns the number of candidate words, up to limit of them and the
+        untried letter found in the most candidates (None if there is none).
+        Args:
+            pattern: The word in progress, '_' for hidden letters
+            tried: The letters already guessed"""
+        pattern = pattern.upper()
+        tried = set(tried.upper())
+        length_index = self.length_index(len(pattern))
+        cache_key = (pattern, ''.join(sorted(tried)))
+        cached = self._hints.get(cache_key)
+        if cached is None:
+            candidates = length_index.candidates(pattern, tried)
+            best_letter, best_count = None, 0
+            for letter in LETTERS:
+                if letter in tried:
+                    continue
+                count = popcount(
+                    candidates & length_index.contains[ord(letter) - 65])
+                if count > best_count:
+                    best_letter, best_count = letter, count
+            cached = (candidates, popcount(candidates), best_letter)
+            if len(self._hints) >= HINT_CACHE_SIZE:
+                self._hints.clear()
+            self._hints[cache_key] = cached
+        candidates, count, best_letter = cached
+        return count, length_index.words(candidates, limit), best_letter
+
+
+def solve(engine, word, attempts=10):
+    """Plays a game of word with the best letter of every hint. Returns True
+    if it is found before the attempts run out."""
+    pattern = BLANK * len(word)
+    tried = ''
+    while attempts > 0 and BLANK in pattern:
+        _, _, letter = engine.hint(pattern, tried, limit=0)
+        if letter is None:
+            # The word is not in the dictionary, guess the next letter
+            letter = [char for char in LETTERS if char not in tried][0]
+        tried += letter
+        if letter in word:
+            pattern = ''.join(char if char == letter else shown
+                              for char, shown in zip(word, pattern))
+        else:
+            attempts -= 1
+    return BLANK not in pattern
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine():
+    """Returns the instance wide HintEngine over the word dictionary"""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = HintEngine(words.get_index())
+    return _engine
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Hangman solver')
+    parser.add_argument('--games', type=int, default=100)
+    parser.add_argument('--attempts', type=int, default=10)
+    args = parser.parse_args()
+    index = words.get_index()
+    engine = get_engine()
+    won = sum(solve(engine, index.random_word(), args.attempts)
+              for _ in range(args.games))
+    print('{} of {} games won ({:.1f}%)'.format(
+        won, args.games, 100.0 * won / args.games))
@@ -0,0 +1,153 @@
+"""instrumentation.py - Per-endpoint cost accounting for the API methods.
+
+Methods decorated with @instrumented record, for a sample of their calls,
+the wall time and the API RPCs they make: datastore gets, puts and queries,
+the entities read and written, memcache hits and misses and task queue
+enqueues. The RPCs are counted by an apiproxy post-call hook into the record
+of the current thread. Aggregates, including a latency histogram, are kept
+per instance and reported by the admin stats handler in main.py.
+
+The share of sampled calls is read from the INSTRUMENTATION_SAMPLE_RATE
+environment variable (app.yaml), 0 turns the instrumentation off. Calls that
+are not sampled only cost a random() draw.
+"""
+
+import bisect
+import collections
+import functools
+import os
+import random
+import threading
+import time
+from google.appengine.api import apiproxy_stub_map
+
+SAMPLE_RATE = float(os.environ.get('INSTRUMENTATION_SAMPLE_RATE', '0.1'))
+# Upper bounds (ms) of the latency histogram buckets, the last is open
+LATENCY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+COUNTERS = ('datastore_gets', 'datastore_puts', 'datastore_queries',
+            'entities_read', 'entities_written', 'memcache_hits',
+            'memcache_misses', 'taskqueue_adds')
+
+_local = threading.local()
+_lock = threading.Lock()
+_stats = {}
+_hooked_apiproxy = None
+
+
+def _rpc_hook(service, call, request, response):
+    """Counts an API call into the record of the current thread, if any"""
+    record = getattr(_local, 'record', None)
+    if record is None:
+        return
+    if service == 'datastore_v3':
+        if call == 'Get':
+            record['datastore_gets'] += 1
+            record['entities_read'] += sum(
+                1 for result in response.entity_list() if result.has_entity())
+        elif call == 'Put':
+            record['datastore_puts'] += 1
+            record['entities_written'] += request.entity_size()
+        elif call == 'RunQuery':
+            record['datastore_queries'] += 1
+            record['entities_read'] += response.result_size()
+        elif call == 'Next':
+            record['entities_read'] += response.result_size()
+    elif service == 'memcache' and call == 'Get':
+        hits = response.item_size()
+        record['memcache_hits'] += hits
+        record['memcache_misses'] += request.key_size() - hits
+    elif service == 'taskqueue':
+        if call == 'Add':
+            record['taskqueue_adds'] += 1
+        elif call == 'BulkAdd':
+            record['taskqueue_adds'] += request.add_request_size()
+
+
+def _install_hook():
+    """Adds the RPC hook to the current apiproxy (replaced by the testbed)"""
+    global _hooked_apiproxy
+    apiproxy = apiproxy_stub_map.apiproxy
+    if apiproxy is not _hooked_apiproxy:
+        with _lock:
+            if apiproxy is not _hooked_apiproxy:
+                apiproxy.GetPostCallHooks().Append('instrumentation',
+                                                   _rpc_hook)
+                _hooked_apiproxy = apiproxy
+
+
+def _new_stats():
+    stats = dict((name, 0) for name in COUNTERS)
+    stats.update(calls=0, errors=0, total_ms=0.0,
+                 latency_histogram=[0] * (len(LATENCY_BUCKETS) + 1))
+    return stats
+
+
+def _add_record(name, record, elapsed_ms, failed):
+    bucket = bisect.bisect_left(LATENCY_BUCKETS, elapsed_ms)
+    with _lock:
+        stats = _stats.get(name)
+        if stats is None:
+            stats = _stats[name] = _new_stats()
+        stats['calls'] += 1
+        stats['errors'] += int(failed)
+        stats['total_ms'] += elapsed_ms
+        stats['latency_histogram'][bucket] += 1
+        for counter in COUNTERS:
+            stats[counter] += record[counter]
+
+
+def instrumented(func):
+    """Decorator recording the cost of a sample of the calls of an API
+    method. Place it below @endpoints.method."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        # Nested calls are counted in the outer record only
+        if SAMPLE_RATE <= 0 or getattr(_local, 'record', None) is not None \
+                or random.random() >= SAMPLE_RATE:
+            return func(*args, **kwargs)
+        _install_hook()
+        record = _local.record = collections.Counter()
+        failed = True
+        start = time.time()
+        try:
+            result = func(*args, **kwargs)
+            failed = False
+            return result
+        finally:
+            _local.record = None
+            _add_record(func.__name__, record, (time.time() - start) * 1000,
+                        failed)
+    return wrapper
+
+
+def get_stats():
+    """Returns the aggregates of this instance, per method. Each has the
+    sampled calls, the errors, the mean latency, the latency histogram and
+    the mean of every RPC counter per call."""
+    with _lock:
+        snapshot = dict((name, dict(stats, latency_histogram=list(
+            stats['latency_histogram']))) for name, stats in _stats.items())
+    methods = {}
+    for name, stats in snapshot.items():
+        calls = stats['calls']
+        methods[name] = {
+            'sampled_calls': calls,
+            'errors': stats['errors'],
+            'mean_ms': round(stats['total_ms'] / calls, 3),
+            'latency_histogram': dict(
+                ('<={}ms'.format(bound) if i < len(LATENCY_BUCKETS)
+                 else '>{}ms'.format(LATENCY_BUCKETS[-1]), count)
+                for i, (bound, count) in enumerate(zip(
+                    LATENCY_BUCKETS + (LATENCY_BUCKETS[-1],),
+                    stats['latency_histogram']))),
+            'per_call': dict((counter, round(float(stats[counter]) / calls, 3))
+                             for counter in COUNTERS),
+        }
+    return {'instance': os.environ.get('INSTANCE_ID', ''),
+            'sample_rate': SAMPLE_RATE,
+            'methods': methods}
+
+
+def reset_stats():
+    with _lock:
+        _stats.clear()
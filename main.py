@@ -1,45 +1,332 @@
 #!/usr/bin/env python
 
 """main.py - This file contains handlers that are called by taskqueue and/or
-cronjobs."""
+cronjobs. Modules only some handlers need are imported in those handlers,
+so a new instance serving one route does not load them all."""
 
+import datetime
+import json
+import logging
+import time
 import webapp2
-from google.appengine.api import mail, app_identity
+from google.appengine.api import memcache
+from google.appengine.datastore.datastore_query import Cursor
 from google.appengine.ext import ndb
-from api import GuessANumberApi
 
-from models import User, Game
+from models import User, Game, Leaderboard, UserStats
+import counters
+from utils import cache_stats, add_named_task
+
+# Active games read by one scan task
+REMINDER_SCAN_SIZE = 500
+# Users mailed by one batch task
+REMINDER_BATCH_SIZE = 100
+REMINDER_MEMCACHE_PREFIX = 'REMINDER:'
+# Lifetime of the memcache state of a reminder run
+REMINDER_RUN_TTL = 24 * 60 * 60
+# Games migrated to the inline move log by one task
+HISTORY_MIGRATION_SIZE = 100
+# Users checked for a missing UserAlias by one task
+USER_MIGRATION_SIZE = 500
+# Users whose stats are rebuilt by one task
+USER_STATS_REBUILD_SIZE = 20
+ARCHIVE_MEMCACHE_PREFIX = 'ARCHIVE:'
+
+
+def _reminder_key(run_id, name):
+    return '{}{}:{}'.format(REMINDER_MEMCACHE_PREFIX, run_id, name)
+
+
+def _reminder_step_done(run_id, step):
+    """Counts a step of the run as done, once, and logs the summary of the
+    run when it was the last one"""
+    if not memcache.add(_reminder_key(run_id, 'done:' + step), True,
+                        time=REMINDER_RUN_TTL):
+        return
+    if memcache.decr(_reminder_key(run_id, 'pending')) == 0:
+        totals = memcache.get_multi(['processed', 'sent'],
+                                    key_prefix=_reminder_key(run_id, ''))
+        logging.info('Reminder run %s done: %d users processed, %d mailed '
+                     'in %.1fs', run_id, int(totals.get('processed') or 0),
+                     int(totals.get('sent') or 0), time.time() - int(run_id))
 
 
 class SendReminderEmail(webapp2.RequestHandler):
     def get(self):
-        """Send a reminder email to each User with an email about games.
-        Called every hour using a cron job"""
-        app_id = app_identity.get_application_id()
-        users = User.query(User.email != None)
-        for user in users:
-            ancestor_key = ndb.Key(User, user.name)
-            game_count = Game.query(ancestor=ancestor_key).filter(
-                        Game.game_over == False, Game.canceled == False).count()
-            if game_count > 0:
-                subject = 'Active games'
-                body = 'Hello {}, dont forget you still have active games!'.format(user.name)
-                # This will send test emails, the arguments to send_mail are:
-                # from, to, subject, body
-                mail.send_mail('noreply@{}.appspotmail.com'.format(app_id),
-                                user.email,
-                                subject,
-                                body)
+        """Start a reminder run for each User with active games.
+        Called every hour using a cron job. The run is a chain of scan tasks,
+        each reading one cursor page of active games, that fan out mail
+        batches for the users found. The run counts its pending steps, the
+        scan and each batch, and the step that brings the count to zero logs
+        the summary of the run."""
+        run_id = str(int(time.time()))
+        memcache.set(_reminder_key(run_id, 'pending'), 1,
+                     time=REMINDER_RUN_TTL)
+        add_named_task('reminder-{}-scan-0'.format(run_id),
+                       '/tasks/reminder_scan', {'run_id': run_id, 'page': 0})
+
+
+class ReminderScan(webapp2.RequestHandler):
+    def post(self):
+        """Read one page of active games and enqueue mail batches for their
+        users, then the scan of the next page."""
+        run_id = self.request.get('run_id')
+        page = int(self.request.get('page'))
+        cursor = Cursor(urlsafe=self.request.get('cursor') or None)
+        last_user = self.request.get('last_user')
+        # Ordered by key, so the games of a user are next to each other
+        keys, cursor, more = Game.query(
+            Game.game_over == False, Game.canceled == False).order(
+            Game.key).fetch_page(REMINDER_SCAN_SIZE, start_cursor=cursor,
+                                 keys_only=True)
+        users = []
+        for key in keys:
+            user = key.parent().urlsafe()
+            if user != last_user:
+                users.append(user)
+                last_user = user
+        for i in range(0, len(users), REMINDER_BATCH_SIZE):
+            batch = '{}-{}'.format(page, i)
+            # Counted once, before it is enqueued, even if this task retries
+            if memcache.add(_reminder_key(run_id, 'queued:' + batch), True,
+                            time=REMINDER_RUN_TTL):
+                memcache.incr(_reminder_key(run_id, 'pending'))
+            add_named_task('reminder-{}-mail-{}'.format(run_id, batch),
+                           '/tasks/reminder_batch',
+                           {'run_id': run_id, 'batch': batch,
+                            'user': users[i:i + REMINDER_BATCH_SIZE]})
+        if more and cursor:
+            add_named_task('reminder-{}-scan-{}'.format(run_id, page + 1),
+                           '/tasks/reminder_scan',
+                           {'run_id': run_id, 'page': page + 1,
+                            'cursor': cursor.urlsafe(),
+                            'last_user': last_user or ''})
+        else:
+            logging.info('Reminder run %s: scan of %d pages done in %.1fs',
+                         run_id, page + 1, time.time() - int(run_id))
+            _reminder_step_done(run_id, 'scan')
+
+
+class ReminderBatch(webapp2.RequestHandler):
+    def post(self):
+        """Send a reminder email to each user of the batch that has an email.
+        Users already processed in this run are skipped, and not counted
+        again, when the task is retried."""
+        from reminders import send_reminder
+        run_id = self.request.get('run_id')
+        keys = [ndb.Key(urlsafe=user) for user in self.request.get_all('user')]
+        done_keys = [_reminder_key(run_id, key.urlsafe()) for key in keys]
+        done = memcache.get_multi(done_keys)
+        processed = sent = 0
+        for user, done_key in zip(ndb.get_multi(keys), done_keys):
+            if done_key in done:
+                continue
+            if user and user.email:
+                send_reminder(user)
+                sent += 1
+            processed += 1
+            memcache.set(done_key, True, time=REMINDER_RUN_TTL)
+        memcache.offset_multi({'processed': processed, 'sent': sent},
+                              key_prefix=_reminder_key(run_id, ''),
+                              initial_value=0)
+        _reminder_step_done(run_id, 'batch:' + self.request.get('batch'))
+
+
+class MigrateGameHistory(webapp2.RequestHandler):
+    def post(self):
+        """Fold the GameHistory entities of one page of games into their
+        inline move log, then enqueue the next page. Every game is folded
+        in its own transaction, so a failed task can simply run again."""
+        run_id = self.request.get('run_id') or str(int(time.time()))
+        page = int(self.request.get('page') or 0)
+        cursor = Cursor(urlsafe=self.request.get('cursor') or None)
+        keys, cursor, more = Game.query().fetch_page(
+            HISTORY_MIGRATION_SIZE, start_cursor=cursor, keys_only=True)
+        folded = sum(Game.fold_history(key) for key in keys)
+        logging.info('History migration %s page %d: %d games, %d entities '
+                     'folded', run_id, page, len(keys), folded)
+        if more and cursor:
+            add_named_task('history-{}-{}'.format(run_id, page + 1),
+                           '/tasks/migrate_game_history',
+                           {'run_id': run_id, 'page': page + 1,
+                            'cursor': cursor.urlsafe()})
+
+
+class MigrateUsers(webapp2.RequestHandler):
+    def post(self):
+        """Create the UserAlias of the users of one page that are not keyed
+        by name, then enqueue the next page. Safe to run again."""
+        run_id = self.request.get('run_id') or str(int(time.time()))
+        page = int(self.request.get('page') or 0)
+        cursor = Cursor(urlsafe=self.request.get('cursor') or None)
+        keys, cursor, more = User.query().fetch_page(
+            USER_MIGRATION_SIZE, start_cursor=cursor, keys_only=True)
+        created = User.add_legacy_aliases(keys)
+        logging.info('User migration %s page %d: %d users, %d aliases '
+                     'created', run_id, page, len(keys), created)
+        if more and cursor:
+            add_named_task('users-{}-{}'.format(run_id, page + 1),
+                           '/tasks/migrate_users',
+                           {'run_id': run_id, 'page': page + 1,
+                            'cursor': cursor.urlsafe()})
+
+
+class StartArchive(webapp2.RequestHandler):
+    def get(self):
+        """Start an archival run of the finished games and scores older than
+        archive.ARCHIVE_AGE_DAYS. Called every day using a cron job."""
+        import archive
+        run_id = str(int(time.time()))
+        add_named_task('archive-{}-Game-0'.format(run_id), '/tasks/archive',
+                       {'run_id': run_id, 'kind': 'Game', 'page': 0,
+                        'cutoff': archive.default_cutoff().isoformat()})
+
+
+class ArchiveTask(webapp2.RequestHandler):
+    def post(self):
+        """Archive and delete one batch of entities, then enqueue the next
+        batch, or the first batch of the next kind. The cutoff and cursor
+        travel with the tasks, so an interrupted run resumes where it
+        stopped."""
+        import archive
+        run_id = self.request.get('run_id')
+        kind = self.request.get('kind')
+        page = int(self.request.get('page'))
+        cutoff_param = self.request.get('cutoff')
+        cutoff = datetime.datetime.strptime(cutoff_param.split('.')[0],
+                                            '%Y-%m-%dT%H:%M:%S')
+        cursor = Cursor(urlsafe=self.request.get('cursor') or None)
+        attempt = self.request.headers.get('X-AppEngine-TaskRetryCount', '0')
+        name = 'archive/{}/{}-{:06d}-{}.ndjson.gz'.format(run_id, kind, page,
+                                                          attempt)
+        start = time.time()
+        count, cursor, more = archive.archive_batch(kind, cutoff, name, cursor)
+        elapsed = time.time() - start
+        total = memcache.incr('{}{}'.format(ARCHIVE_MEMCACHE_PREFIX, run_id),
+                              count, initial_value=0) or 0
+        logging.info('Archive run %s %s batch %d: %d entities in %.1fs '
+                     '(%.0f/s); %d in %.1fs for the run', run_id, kind, page,
+                     count, elapsed, count / max(elapsed, 0.001), total,
+                     time.time() - int(run_id))
+
+        params = {'run_id': run_id, 'cutoff': cutoff_param}
+        if more and cursor:
+            params.update(kind=kind, page=page + 1, cursor=cursor.urlsafe())
+        else:
+            position = archive.KINDS.index(kind) + 1
+            if position == len(archive.KINDS):
+                logging.info('Archive run %s done: %d entities at %.0f/s',
+                             run_id, total,
+                             total / max(time.time() - int(run_id), 1))
+                return
+            params.update(kind=archive.KINDS[position], page=0)
+        add_named_task('archive-{}-{}-{}'.format(run_id, params['kind'],
+                                                 params['page']),
+                       '/tasks/archive', params)
+
+
+class RebuildLeaderboards(webapp2.RequestHandler):
+    def post(self):
+        """Rebuild the leaderboards from one page of the existing scores,
+        then enqueue the next page. Entries are deduped by score, so a
+        failed task can simply run again."""
+        run_id = self.request.get('run_id') or str(int(time.time()))
+        page = int(self.request.get('page') or 0)
+        cursor = Cursor(urlsafe=self.request.get('cursor') or None)
+        count, cursor, more = Leaderboard.rebuild_page(run_id, page, cursor)
+        logging.info('Leaderboard rebuild %s page %d: %d scores', run_id,
+                     page, count)
+        if more and cursor:
+            add_named_task('leaderboards-{}-{}'.format(run_id, page + 1),
+                           '/tasks/rebuild_leaderboards',
+                           {'run_id': run_id, 'page': page + 1,
+                            'cursor': cursor.urlsafe()})
+
+
+class RebuildUserStats(webapp2.RequestHandler):
+    def post(self):
+        """Rebuild the stats of one page of users from their scores, then
+        enqueue the next page. Every user is rebuilt on its own, so a failed
+        task can simply run again."""
+        run_id = self.request.get('run_id') or str(int(time.time()))
+        page = int(self.request.get('page') or 0)
+        cursor = Cursor(urlsafe=self.request.get('cursor') or None)
+        keys, cursor, more = User.query().fetch_page(
+            USER_STATS_REBUILD_SIZE, start_cursor=cursor, keys_only=True)
+        games = sum(UserStats.rebuild_user(key) for key in keys)
+        logging.info('User stats rebuild %s page %d: %d users, %d games',
+                     run_id, page, len(keys), games)
+        if more and cursor:
+            add_named_task('user-stats-{}-{}'.format(run_id, page + 1),
+                           '/tasks/rebuild_user_stats',
+                           {'run_id': run_id, 'page': page + 1,
+                            'cursor': cursor.urlsafe()})
+
+
+class CacheStats(webapp2.RequestHandler):
+    def get(self):
+        """Report the entity cache hit/miss counters."""
+        self.response.content_type = 'application/json'
+        self.response.write(json.dumps(cache_stats()))
+
+
+class EndpointStats(webapp2.RequestHandler):
+    def get(self):
+        """Report the cost of the API methods sampled on this instance."""
+        self.response.content_type = 'application/json'
+        import instrumentation
+        self.response.write(json.dumps(instrumentation.get_stats()))
 
 
 class UpdateAverageMovesRemaining(webapp2.RequestHandler):
     def post(self):
         """Update game listing announcement in memcache."""
-        # GuessANumberApi._cache_average_attempts()
+        counters.cache_average_attempts()
         self.response.set_status(204)
 
 
+class ReconcileGameStats(webapp2.RequestHandler):
+    def get(self):
+        """Correct the drift of the active game counters.
+        Called every day using a cron job"""
+        totals = counters.reconcile()
+        logging.info('Game stats reconciled: %(active_games)d active games, '
+                     '%(attempts_remaining)d attempts remaining', totals)
+
+
+class Warmup(webapp2.RequestHandler):
+    def get(self):
+        """Load what the first requests of a new instance would otherwise
+        pay for: the API modules, the word dictionary and its hint indexes,
+        and the leaderboard and game counter caches. Called by App Engine
+        before the instance receives traffic."""
+        start = time.time()
+        # Builds the Endpoints services served by api.api
+        import api
+        import hints
+        import words
+        index = words.get_index()
+        engine = hints.get_engine()
+        for length in sorted(set(bucket[0] for bucket in index.buckets())):
+            engine.length_index(length)
+        Leaderboard.top()
+        counters.get_totals()
+        logging.info('Warmup done in %.2fs', time.time() - start)
+
+
 app = webapp2.WSGIApplication([
-    ('/crons/send_reminder', SendReminderEmail)
-  #  ('/tasks/cache_average_attempts', UpdateAverageMovesRemaining),
+    ('/_ah/warmup', Warmup),
+    ('/crons/send_reminder', SendReminderEmail),
+    ('/crons/reconcile_game_stats', ReconcileGameStats),
+    ('/crons/archive', StartArchive),
+    ('/tasks/reminder_scan', ReminderScan),
+    ('/tasks/reminder_batch', ReminderBatch),
+    ('/tasks/rebuild_leaderboards', RebuildLeaderboards),
+    ('/tasks/rebuild_user_stats', RebuildUserStats),
+    ('/tasks/migrate_game_history', MigrateGameHistory),
+    ('/tasks/migrate_users', MigrateUsers),
+    ('/tasks/archive', ArchiveTask),
+    ('/admin/cache_stats', CacheStats),
+    ('/admin/endpoint_stats', EndpointStats),
+    ('/tasks/cache_average_attempts', UpdateAverageMovesRemaining)
 ], debug=True)
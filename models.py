@@ -2,14 +2,37 @@
 entities used by the Game. Because these classes are also regular Python
 classes they can include methods (such as 'to_form' and 'new_game')."""
 
+import hashlib
+import logging
+import os
 import random
 from datetime import date
 from protorpc import messages
+from google.appengine.api import datastore_errors
+from google.appengine.api import memcache
 from google.appengine.ext import ndb
+import counters
+import rules
+import words
+from utils import uncache_entity, wait_after_commit, wait_all
+
+# Where new games keep their moves: 'entity' for one GameHistory entity per
+# event, 'inline' for a packed log on the Game itself
+HISTORY_MODE = os.environ.get('GAME_HISTORY_MODE', 'entity')
+# Inline log code of an event -> its message; index codes are 'Found'
+HISTORY_CODES = {'-': 'Not found', '!': 'Not attempts remaining you lose'}
+HISTORY_MESSAGES = dict((message, code)
+                        for code, message in HISTORY_CODES.items())
 
 
 class User(ndb.Model):
     """User profile"""
+    MEMCACHE_PREFIX = 'USER:'
+    # Seconds a name is remembered as missing
+    MISSING_TTL = 30
+    FOUND_TTL = 60 * 60
+    MISSING = 'missing'
+    
     name = ndb.StringProperty(required=True)
     email = ndb.StringProperty()
     date_created = ndb.DateTimeProperty(auto_now_add=True)
@@ -22,8 +45,73 @@ class User(ndb.Model):
                     name=user_name,
                     email=email)
         user.put()
+        memcache.set(cls.MEMCACHE_PREFIX + user_name, user, time=cls.FOUND_TTL)
         return user;
     
+    @classmethod
+    def get_by_name(cls, user_name):
+        """Returns the User with that name or None. Users are keyed by name,
+        so this is a strongly consistent key get; users created before that
+        are found through their UserAlias. Found and missing names are both
+        cached in memcache, missing ones for MISSING_TTL seconds."""
+        return cls.get_by_name_async(user_name).get_result()
+    
+    @classmethod
+    @ndb.tasklet
+    def get_by_name_async(cls, user_name):
+        """Tasklet version of get_by_name"""
+        if not user_name:
+            raise ndb.Return(None)
+        context = ndb.get_context()
+        cache_key = cls.MEMCACHE_PREFIX + user_name
+        user = yield context.memcache_get(cache_key)
+        if user == cls.MISSING:
+            raise ndb.Return(None)
+        if user is not None:
+            raise ndb.Return(user)
+        user, alias = yield ndb.get_multi_async(
+            [ndb.Key(User, user_name), ndb.Key(UserAlias, user_name)])
+        if user is None and alias is not None:
+            user = yield alias.user.get_async()
+        if user is None:
+            # Added, not set: a create_user that ran since the read above
+            # has cached the new user, which must not be hidden
+            yield context.memcache_add(cache_key, cls.MISSING,
+                                       time=cls.MISSING_TTL)
+        else:
+            yield context.memcache_set(cache_key, user, time=cls.FOUND_TTL)
+        raise ndb.Return(user)
+    
+    @classmethod
+    def add_legacy_aliases(cls, keys):
+        """Creates the UserAlias of the users among keys that are not keyed
+        by their name. Returns the number of aliases created."""
+        legacy = [user for user in ndb.get_multi(
+            [key for key in keys if key.string_id() is None]) if user]
+        if not legacy:
+            return 0
+        existing = ndb.get_multi([ndb.Key(User, user.name) for user in legacy] +
+                                 [ndb.Key(UserAlias, user.name)
+                                  for user in legacy])
+        named, aliased = existing[:len(legacy)], existing[len(legacy):]
+        aliases = []
+        for user, named_user, alias in zip(legacy, named, aliased):
+            if named_user is not None:
+                logging.warning('User %s exists both keyed by name and as %s',
+                                user.name, user.key)
+            elif alias is None:
+                aliases.append(UserAlias(id=user.name, user=user.key))
+        ndb.put_multi(aliases)
+        memcache.delete_multi([alias.key.id() for alias in aliases],
+                              key_prefix=cls.MEMCACHE_PREFIX)
+        return len(aliases)
+    
+
+class UserAlias(ndb.Model):
+    """Name key of a User created before users were keyed by name"""
+    user = ndb.KeyProperty(required=True, kind='User')
+    
+
 
 class GameHistory(ndb.Model):
     """Game history object"""
@@ -41,11 +129,34 @@ class GameHistory(ndb.Model):
         form.message = self.message
         return form
     
+    @classmethod
+    def new_game_history(cls, game, guess, found, index, message, id=None):
+        """Returns an unsaved history entry, to be written in a batch"""
+        return GameHistory(parent=ndb.Key(Game, game), id=id,
+                           guess=guess, found=found, index=index, message=message)
+    
     @classmethod
     def create_game_history(cls, game, guess, found, index, message):
-        game_history = GameHistory(parent=ndb.Key(Game, game),
-                                   guess=guess, found=found, index=index, message=message)
+        game_history = cls.new_game_history(game, guess, found, index, message)
         game_history.put()
+    
+    @staticmethod
+    def pack(guess, found, index, message):
+        """Returns the inline log entry of an event, e.g. 'E3' for a letter
+        found at index 3 or 'Q-' for a letter not found"""
+        if message == 'Found' and found:
+            return guess + str(index)
+        return guess + HISTORY_MESSAGES[message]
+    
+    @staticmethod
+    def unpack(entry):
+        """Returns the GameHistoryForm of an inline log entry"""
+        guess, code = entry[0], entry[1:]
+        if code in HISTORY_CODES:
+            return GameHistoryForm(guess=guess, found=False, index=-1,
+                                   message=HISTORY_CODES[code])
+        return GameHistoryForm(guess=guess, found=True, index=int(code),
+                               message='Found')
         
 
 class Game(ndb.Model):
@@ -57,22 +168,33 @@ class Game(ndb.Model):
     attempts_remaining = ndb.IntegerProperty(required=True, default=10)
     game_over = ndb.BooleanProperty(required=True, default=False)
     canceled = ndb.BooleanProperty(required=True, default=False)
+    # Letters already tried, packed in guess order, e.g. 'EAS'. Unset on
+    # games started before it was stored; see get_guessed_letters.
+    guessed_letters = ndb.StringProperty(indexed=False)
+    # Set when the moves are kept in move_log instead of GameHistory
+    history_inline = ndb.BooleanProperty(indexed=False, default=False)
+    # Space separated GameHistory.pack entries, oldest first
+    move_log = ndb.TextProperty(default='')
     date_created = ndb.DateTimeProperty(auto_now_add=True)
     
     @classmethod
-    def create_game(cls, user):
-        """Creates and returns a new game"""
-        words = ['HANGMAN', 'ZOO', 'PYTHON', 'GRANDMOTHER',
-                 'RELATIONSHIP', 'SWIFT', 'PRESIDENT']
-        target_word = random.choice(words)
+    def create_game(cls, user, difficulty=None, length=None, letters=None):
+        """Creates and returns a new game. The word is picked from the
+        dictionary using the optional difficulty, word length and number of
+        distinct letters. Raises ValueError if no word matches."""
+        target_word = words.get_index().random_word(difficulty, length, letters)
         temp = ['_'] * (len(target_word))
         word_in_progress = ''.join(temp)
         game = Game(parent=user,
                     guess_word=target_word,
                     user=user,
-                    word_in_progress=word_in_progress)
+                    word_in_progress=word_in_progress,
+                    guessed_letters='',
+                    history_inline=HISTORY_MODE == 'inline')
         
         game.put()
+        wait_after_commit([counters.game_changed_async(game, False, 0)],
+                          'creating a game')
         return game
 
     def to_form(self, message):
@@ -85,29 +207,408 @@ class Game(ndb.Model):
         form.attempts_allowed = self.attempts_allowed
         form.attempts_remaining = self.attempts_remaining
         form.message = message
+        form.version = self.version
         return form
 
+    @property
+    def version(self):
+        """Token of the state of the game and of its history, changed by
+        every accepted move and by the end of the game"""
+        state = u'{}|{}|{}|{:d}|{:d}'.format(
+            self.word_in_progress, self.guessed_letters or u'',
+            self.attempts_remaining, self.game_over, self.canceled)
+        return hashlib.md5(state.encode('utf-8')).hexdigest()[:12]
+
+    def _post_put_hook(self, future):
+        # Drop the cached copy; once more on commit, because a read during
+        # the transaction can cache the old state again
+        uncache_entity(self.key)
+        if ndb.in_transaction():
+            key = self.key
+            ndb.get_context().call_on_commit(lambda: uncache_entity(key))
+
+    @classmethod
+    def _post_delete_hook(cls, key, future):
+        uncache_entity(key)
+
+    def add_history(self, guess, found, index, message):
+        """Records an event in the history of the game. Returns the unsaved
+        GameHistory entity, or None when the history is kept inline and is
+        saved with the game."""
+        entry = GameHistory.pack(guess, found, index, message)
+        if self.history_inline:
+            self.move_log = ' '.join(filter(None, [self.move_log, entry]))
+            return None
+        # Named by its packed entry, unique within the game: with a complete
+        # key ndb writes it in the same Put RPC as the game
+        return GameHistory.new_game_history(self.key.urlsafe(), guess, found,
+                                            index, message, id=entry)
+
+    def inline_history_forms(self):
+        """Returns the GameHistoryForms of the inline move log"""
+        return [GameHistory.unpack(entry)
+                for entry in (self.move_log or '').split()]
+
+    def history_query(self):
+        """Returns the query of the GameHistory entities of the game"""
+        return GameHistory.query(
+            ancestor=ndb.Key(Game, self.key.urlsafe())).order(
+            GameHistory.date_created)
+
+    @classmethod
+    def fold_history(cls, game_key):
+        """Moves the GameHistory entities of a game into its inline move log,
+        in one transaction. Returns the number of entities folded."""
+        @ndb.transactional(xg=True)
+        def fold():
+            game = game_key.get()
+            if not game or game.history_inline:
+                return 0
+            history = game.history_query().fetch()
+            game.move_log = ' '.join(
+                GameHistory.pack(entry.guess, entry.found, entry.index,
+                                 entry.message) for entry in history)
+            game.history_inline = True
+            game.put()
+            ndb.delete_multi([entry.key for entry in history])
+            return len(history)
+        return fold()
+
+    def get_guessed_letters(self):
+        """Returns the letters already tried. On games started before they
+        were stored, they are read back once from the history, in order, and
+        kept on the game so its next put saves them."""
+        if self.guessed_letters is None:
+            if self.history_inline:
+                guesses = [GameHistory.unpack(entry).guess
+                           for entry in (self.move_log or '').split()]
+            else:
+                guesses = [entry.guess for entry in self.history_query()]
+            letters = ''
+            for guess in guesses:
+                if guess not in letters:
+                    letters += guess
+            self.guessed_letters = letters
+        return self.guessed_letters
+
+    def to_state(self):
+        """Returns the rules.GameState of the game"""
+        return rules.GameState(self.guess_word, self.word_in_progress,
+                               self.get_guessed_letters(),
+                               self.attempts_allowed, self.attempts_remaining,
+                               self.game_over)
+
+    def update_from_state(self, state):
+        """Copies the progress of a rules.GameState back to the game. Ending
+        the game is left to finish_game."""
+        self.word_in_progress = state.word_in_progress
+        self.guessed_letters = state.guessed_letters
+        self.attempts_remaining = state.attempts_remaining
+
+    def finish_game(self, won=False):
+        """Marks the game as over and returns its unsaved Score, so the
+        caller can write the game and the score in one batch."""
+        self.game_over = True
+        # Add the game to the score 'board'. One score per game, named by
+        # it: with a complete key ndb writes it in the same Put RPC as the
+        # game
+        score = Score(id=self.key.urlsafe(),
+                      user=self.user, user_name=self.user.string_id(),
+                      date=date.today(), won=won,
+                      guesses=self.attempts_allowed - self.attempts_remaining)
+        return score
+
     def end_game(self, won=False):
         """Ends the game - if won is True, the player won. - if won is False,
         the player lost."""
-        self.game_over = True
-        self.put()
-        # Add the game to the score 'board'
-        score = Score(user=self.user, date=date.today(), won=won,
-                      guesses=self.attempts_allowed - self.attempts_remaining)
-        score.put()
+        attempts_before = self.attempts_remaining
+        score = self.finish_game(won)
+
+        @ndb.transactional(xg=True)
+        def save():
+            ndb.put_multi([self, score, UserStats.add_score(score)])
+        save()
+        wait_after_commit(
+            [counters.game_changed_async(self, True, attempts_before),
+             Leaderboard.record_score_async(score)], 'ending a game')
 
 
 class Score(ndb.Model):
     """Score object"""
     user = ndb.KeyProperty(required=True, kind='User')
+    # Denormalized copy of the user name so listings need no User lookup
+    user_name = ndb.StringProperty(indexed=False)
     date = ndb.DateProperty(required=True)
     won = ndb.BooleanProperty(required=True)
     guesses = ndb.IntegerProperty(required=True)
 
-    def to_form(self):
-        return ScoreForm(user_name=self.user.get().name, won=self.won,
+    def to_form(self, user_name=None):
+        if user_name is None:
+            user_name = self.user_name or self.user.get().name
+        return ScoreForm(user_name=user_name, won=self.won,
                          date=str(self.date), guesses=self.guesses)
+
+    @classmethod
+    def to_forms(cls, scores, next_cursor=None):
+        """Returns a ScoreForms for the scores. Names missing on older Score
+        entities are resolved with one batch get of the distinct users."""
+        scores = list(scores)
+        missing = list(set(score.user for score in scores
+                           if not score.user_name))
+        names = {}
+        if missing:
+            names = dict((user.key, user.name)
+                         for user in ndb.get_multi(missing) if user)
+        return ScoreForms(items=[
+            score.to_form(score.user_name or names.get(score.user, ''))
+            for score in scores], next_cursor=next_cursor)
+
+
+class Leaderboard(ndb.Model):
+    """Materialized top scores. The global board is split over several
+    shards to spread the writes; each user has one board under the User."""
+    SIZE = 100
+    GLOBAL_SHARDS = 10
+    MEMCACHE_PREFIX = 'LEADERBOARD:'
+    
+    # Board caches expire after this many seconds
+    MEMCACHE_TTL = 10 * 60
+    # Placed in an empty cache entry by the reader that fills it; a write
+    # deletes it, so the fill's cas fails if the board changed meanwhile
+    FILLING = 'filling'
+    FILLING_TTL = 30
+    # Scores merged by one rebuild task
+    REBUILD_PAGE_SIZE = 200
+    
+    # List of {'user_name', 'date', 'won', 'guesses', 'score'} dicts, best
+    # first; 'score' is the urlsafe Score key, missing on older entries
+    entries = ndb.JsonProperty(default=[])
+    # Rebuild run that last reset the board
+    rebuild_run = ndb.StringProperty(indexed=False)
+    
+    @staticmethod
+    def rank(entry):
+        """Sort key: won games first, then the fewest guesses"""
+        return (not entry['won'], entry['guesses'])
+    
+    @classmethod
+    def merge(cls, entries, new_entries):
+        """Returns the best SIZE entries of both lists. New entries whose
+        score is already on the board are dropped."""
+        scores = set(entry.get('score') for entry in entries)
+        new_entries = [entry for entry in new_entries
+                       if entry.get('score') not in scores]
+        return sorted(list(entries) + new_entries, key=cls.rank)[:cls.SIZE]
+    
+    @staticmethod
+    def entry(score, user_name=None):
+        return {'user_name': user_name or score.user_name,
+                'date': str(score.date),
+                'won': score.won,
+                'guesses': score.guesses,
+                'score': score.key.urlsafe()}
+    
+    @classmethod
+    def global_keys(cls):
+        return [ndb.Key(cls, 'global-{}'.format(i))
+                for i in range(cls.GLOBAL_SHARDS)]
+    
+    @classmethod
+    def user_key(cls, user_key):
+        return ndb.Key(cls, 'top', parent=user_key)
+    
+    @classmethod
+    def _cache_key(cls, user_key=None):
+        if user_key is None:
+            return cls.MEMCACHE_PREFIX + 'global'
+        return cls.MEMCACHE_PREFIX + user_key.urlsafe()
+    
+    @classmethod
+    @ndb.transactional_tasklet
+    def _add_entries_async(cls, key, entries, run_id=None):
+        """Merges the entries into a board. A rebuild run passes its id: the
+        first time the run reaches the board, the board is emptied."""
+        board = (yield key.get_async()) or cls(key=key)
+        current = board.entries
+        reset = run_id and board.rebuild_run != run_id
+        if reset:
+            current = []
+            board.rebuild_run = run_id
+        merged = cls.merge(current, entries)
+        # Skip the write when no entry made the board
+        if reset or merged != board.entries:
+            board.entries = merged
+            yield board.put_async()
+    
+    @classmethod
+    def record_score(cls, score):
+        """Adds a finished game's Score to the global and user boards"""
+        cls.record_score_async(score).get_result()
+    
+    @classmethod
+    @ndb.tasklet
+    def record_score_async(cls, score):
+        """Tasklet version of record_score. The two boards are updated in
+        parallel transactions."""
+        user_name = score.user_name
+        if not user_name:
+            user_name = (yield score.user.get_async()).name
+        entry = cls.entry(score, user_name)
+        yield (cls._add_entries_async(random.choice(cls.global_keys()),
+                                      [entry]),
+               cls._add_entries_async(cls.user_key(score.user), [entry]))
+        yield memcache.Client().delete_multi_async(
+            [cls._cache_key(), cls._cache_key(score.user)])
+    
+    @classmethod
+    def top(cls, user_key=None, limit=0):
+        """Returns the best entries of the global board, or of one user's
+        board, from memcache or with a single batch get."""
+        return cls.top_async(user_key, limit).get_result()
+    
+    @classmethod
+    @ndb.tasklet
+    def top_async(cls, user_key=None, limit=0):
+        """Tasklet version of top. A reader that misses the cache marks the
+        entry as FILLING and stores the boards it read with cas, so a write
+        that deletes the entry in between is not overwritten."""
+        context = ndb.get_context()
+        cache_key = cls._cache_key(user_key)
+        entries = yield context.memcache_get(cache_key)
+        if entries is None:
+            yield context.memcache_add(cache_key, cls.FILLING,
+                                       time=cls.FILLING_TTL)
+            entries = yield context.memcache_get(cache_key, for_cas=True)
+            filling = entries == cls.FILLING
+        else:
+            filling = False
+        if entries is None or entries == cls.FILLING:
+            if user_key is None:
+                keys = cls.global_keys()
+            else:
+                keys = [cls.user_key(user_key)]
+            entries = []
+            for board in (yield ndb.get_multi_async(keys)):
+                if board:
+                    entries = cls.merge(entries, board.entries)
+            if filling:
+                yield context.memcache_cas(cache_key, entries,
+                                           time=cls.MEMCACHE_TTL)
+        if limit > 0:
+            entries = entries[:limit]
+        raise ndb.Return(entries)
+    
+    @classmethod
+    def rebuild_page(cls, run_id, page, cursor=None):
+        """Merges one page of Scores into the boards. The first page of a
+        run empties the global boards, and each user board is emptied the
+        first time the run reaches it. Returns the number of scores read,
+        the next cursor and whether there may be more."""
+        scores, cursor, more = Score.query().fetch_page(
+            cls.REBUILD_PAGE_SIZE, start_cursor=cursor)
+        missing = list(set(score.user for score in scores
+                           if not score.user_name))
+        names = dict((user.key, user.name)
+                     for user in ndb.get_multi(missing) if user)
+        user_entries = {}
+        for score in scores:
+            user_entries.setdefault(score.user, []).append(
+                cls.entry(score, names.get(score.user, '')))
+        global_keys = cls.global_keys()
+        if page == 0:
+            ndb.put_multi([cls(key=key, rebuild_run=run_id)
+                           for key in global_keys])
+        futures = [cls._add_entries_async(
+            global_keys[0], cls.merge([], sum(user_entries.values(), [])),
+            run_id)]
+        futures.extend(cls._add_entries_async(cls.user_key(user_key), entries,
+                                              run_id)
+                       for user_key, entries in user_entries.iteritems())
+        wait_all(futures)
+        memcache.delete_multi([cls._cache_key()] +
+                              [cls._cache_key(key) for key in user_entries])
+        return len(scores), cursor, more
+    
+    @staticmethod
+    def to_forms(entries):
+        return ScoreForms(items=[
+            ScoreForm(user_name=entry['user_name'], date=entry['date'],
+                      won=entry['won'], guesses=entry['guesses'])
+            for entry in entries])
+
+
+class UserStats(ndb.Model):
+    """Running totals of a user's finished games, kept under the User and
+    updated in the transaction that writes each Score"""
+    games_played = ndb.IntegerProperty(default=0, indexed=False)
+    games_won = ndb.IntegerProperty(default=0, indexed=False)
+    total_guesses = ndb.IntegerProperty(default=0, indexed=False)
+    # Wins in a row up to the last game, and the longest such run
+    current_streak = ndb.IntegerProperty(default=0, indexed=False)
+    best_streak = ndb.IntegerProperty(default=0, indexed=False)
+    last_played = ndb.DateProperty(indexed=False)
+
+    @classmethod
+    def stats_key(cls, user_key):
+        return ndb.Key(cls, 'stats', parent=user_key)
+
+    def add(self, score):
+        """Counts one more finished game"""
+        self.games_played += 1
+        self.total_guesses += score.guesses
+        if score.won:
+            self.games_won += 1
+            self.current_streak += 1
+            self.best_streak = max(self.best_streak, self.current_streak)
+        else:
+            self.current_streak = 0
+        self.last_played = max(self.last_played or score.date, score.date)
+
+    @classmethod
+    def add_score(cls, score):
+        """Returns the unsaved stats of the score's user with the score
+        counted. Call it in the transaction that writes the score."""
+        key = cls.stats_key(score.user)
+        stats = key.get() or cls(key=key)
+        stats.add(score)
+        return stats
+
+    @classmethod
+    def rebuild_user(cls, user_key, attempts=3):
+        """Recomputes one user's stats from its Scores, oldest first; scores
+        of the same day count in query order. The stats are replaced in a
+        transaction only if no game of the user finished while the scores
+        were read, else they are read again. Returns the games counted."""
+        key = cls.stats_key(user_key)
+        for _ in range(attempts):
+            before = key.get(use_cache=False, use_memcache=False)
+            played = before.games_played if before else 0
+            stats = cls(key=key)
+            for score in Score.query(Score.user == user_key).order(
+                    Score.date).iter(batch_size=500):
+                stats.add(score)
+            if cls._replace(stats, played):
+                return stats.games_played
+        raise datastore_errors.TransactionFailedError(
+            'Games of {} kept finishing during the rebuild'.format(user_key))
+
+    @staticmethod
+    @ndb.transactional
+    def _replace(stats, played):
+        current = stats.key.get()
+        if (current.games_played if current else 0) != played:
+            return False
+        stats.put()
+        return True
+
+    def to_form(self, user_name):
+        played = self.games_played
+        return UserStatsForm(
+            user_name=user_name, games_played=played, games_won=self.games_won,
+            win_rate=float(self.games_won) / played if played else 0.0,
+            average_guesses=float(self.total_guesses) / played
+            if played else 0.0,
+            current_streak=self.current_streak, best_streak=self.best_streak)
     
     
 class GameHistoryForm(messages.Message):
@@ -127,21 +628,40 @@ class GameForm(messages.Message):
     attempts_allowed = messages.IntegerField(6, required=True)
     attempts_remaining = messages.IntegerField(7, required=True)
     message = messages.StringField(8, required=True)
+    # Game.version, send it back as if_version to poll for changes
+    version = messages.StringField(9)
+    # Set when the client sent the current version
+    not_modified = messages.BooleanField(10)
 
 
 class GameHistoryForms(messages.Message):
     """Used to receive all active games for specific user"""
     items = messages.MessageField(GameHistoryForm, 1, repeated=True)
+    next_cursor = messages.StringField(2)
+    version = messages.StringField(3)
+    # Set, with no items, when the client sent the current version
+    not_modified = messages.BooleanField(4)
     
     
+class HintForm(messages.Message):
+    """Candidate words of a game in progress and the best letter to try"""
+    candidates_count = messages.IntegerField(1, required=True)
+    candidates = messages.StringField(2, repeated=True)
+    best_letter = messages.StringField(3)
+
+
 class GameForms(messages.Message):
     """Uses to receive information  about the game status"""
     items = messages.MessageField(GameForm, 1, repeated=True)
+    next_cursor = messages.StringField(2)
  
 
 class NewGameForm(messages.Message):
     """Used to create a new game"""
     user_name = messages.StringField(1, required=True)
+    difficulty = messages.StringField(2)
+    word_length = messages.IntegerField(3)
+    distinct_letters = messages.IntegerField(4)
 
 
 class MakeMoveForm(messages.Message):
@@ -149,6 +669,23 @@ class MakeMoveForm(messages.Message):
     guess = messages.StringField(1, required=True)
 
 
+class MakeMovesForm(messages.Message):
+    """Used to make several moves in an existing game"""
+    guesses = messages.StringField(1, repeated=True)
+
+
+class MoveResultForm(messages.Message):
+    """Result of one move of a make_moves request"""
+    guess = messages.StringField(1, required=True)
+    message = messages.StringField(2, required=True)
+
+
+class MakeMovesResultForm(messages.Message):
+    """Results of the moves made and the final game state"""
+    results = messages.MessageField(MoveResultForm, 1, repeated=True)
+    game = messages.MessageField(GameForm, 2, required=True)
+
+
 class ScoreForm(messages.Message):
     """ScoreForm for outbound Score information"""
     user_name = messages.StringField(1, required=True)
@@ -160,6 +697,18 @@ class ScoreForm(messages.Message):
 class ScoreForms(messages.Message):
     """Return multiple ScoreForms"""
     items = messages.MessageField(ScoreForm, 1, repeated=True)
+    next_cursor = messages.StringField(2)
+
+
+class UserStatsForm(messages.Message):
+    """UserStatsForm for outbound UserStats information"""
+    user_name = messages.StringField(1, required=True)
+    games_played = messages.IntegerField(2, required=True)
+    games_won = messages.IntegerField(3, required=True)
+    win_rate = messages.FloatField(4, required=True)
+    average_guesses = messages.FloatField(5, required=True)
+    current_streak = messages.IntegerField(6, required=True)
+    best_streak = messages.IntegerField(7, required=True)
 
 
 class StringMessage(messages.Message):
@@ -0,0 +1,18 @@
+"""reminders.py - Reminder emails about active games. Every user with an
+active game is reminded by the hourly cron run in main.py; creating a game
+schedules nothing."""
+
+from google.appengine.api import mail, app_identity
+
+
+def send_reminder(user):
+    """Send the active games reminder email to the user"""
+    app_id = app_identity.get_application_id()
+    subject = 'Active games'
+    body = 'Hello {}, dont forget you still have active games!'.format(user.name)
+    # This will send test emails, the arguments to send_mail are:
+    # from, to, subject, body
+    mail.send_mail('noreply@{}.appspotmail.com'.format(app_id),
+                   user.email,
+                   subject,
+                   body)
@@ -0,0 +1,89 @@
+"""rules.py - The rules of Hangman, free of any datastore access.
+
+GameState holds what the rules need to know about a game and applies
+guesses to it. api.py copies a Game entity into a GameState, plays the
+guess and copies the result back; the simulator plays GameStates directly.
+"""
+
+import string
+
+BLANK = '_'
+FOUND = 'Found'
+NOT_FOUND = 'Not found'
+LOST = 'Not attempts remaining you lose'
+
+
+class MoveResult(object):
+    """Outcome of one guess"""
+    __slots__ = ('message', 'accepted', 'events')
+
+    def __init__(self, message, accepted=False, events=()):
+        # Message for the player
+        self.message = message
+        # False when the guess was rejected and the state is unchanged
+        self.accepted = accepted
+        # History events as (guess, found, index, message) tuples
+        self.events = events
+
+
+class GameState(object):
+    """State of a game of Hangman"""
+    __slots__ = ('word', 'word_in_progress', 'guessed_letters',
+                 'attempts_allowed', 'attempts_remaining', 'game_over', 'won')
+
+    def __init__(self, word, word_in_progress=None, guessed_letters='',
+                 attempts_allowed=10, attempts_remaining=None,
+                 game_over=False, won=False):
+        self.word = word
+        self.word_in_progress = word_in_progress or BLANK * len(word)
+        self.guessed_letters = guessed_letters
+        self.attempts_allowed = attempts_allowed
+        self.attempts_remaining = attempts_allowed \
+            if attempts_remaining is None else attempts_remaining
+        self.game_over = game_over
+        self.won = won
+
+    def guess(self, guess):
+        """Applies a guess to the game and returns its MoveResult"""
+        # Check if the game is finished
+        if self.game_over:
+            return MoveResult('Game already finished!')
+
+        # Only alphabetic character is allowed, A to Z in either case
+        if not guess or any(char not in string.ascii_letters
+                            for char in guess):
+            return MoveResult('Only alphabetic character is allowed!')
+        letter = guess.upper()
+
+        # Only one character is allowed
+        if len(letter) != 1:
+            return MoveResult('Only one character allowed')
+
+        # We will check if the character is already used
+        if letter in self.guessed_letters:
+            return MoveResult('Character already used' + letter)
+        self.guessed_letters += letter
+
+        events = []
+        word = self.word
+        if letter in word:
+            self.word_in_progress = ''.join(
+                char if char == letter else shown
+                for char, shown in zip(word, self.word_in_progress))
+            events = [(letter, True, i, FOUND)
+                      for i, char in enumerate(word) if char == letter]
+            message = 'Key found ' + letter
+        else:
+            events = [(letter, False, -1, NOT_FOUND)]
+            self.attempts_remaining -= 1
+            message = 'Character not found in word: ' + guess
+
+        if self.word_in_progress == word:
+            self.game_over = True
+            self.won = True
+            message = 'You win'
+        elif self.attempts_remaining < 1:
+            self.game_over = True
+            events.append((letter, False, -1, LOST))
+            message += ' Game over!'
+        return MoveResult(message, True, events)
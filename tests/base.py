@@ -0,0 +1,50 @@
+"""base.py - Test case running on the App Engine testbed stubs.
+
+The tests require the App Engine SDK (google.appengine, endpoints, protorpc)
+on the Python path:
+
+    python -m unittest discover -s tests -t .
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from google.appengine.datastore import datastore_stub_util
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+
+
+class TestbedCase(unittest.TestCase):
+    """Activates the datastore, memcache and task queue stubs for each test.
+    Queries are strongly consistent, so the checks do not depend on when the
+    writes are applied."""
+
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        # Endpoints reads the app revision from the version id
+        self.testbed.setup_env(current_version_id='testbed.1',
+                               overwrite=True)
+        policy = datastore_stub_util.PseudoRandomHRConsistencyPolicy(
+            probability=1)
+        self.testbed.init_datastore_v3_stub(consistency_policy=policy)
+        self.testbed.init_memcache_stub()
+        self.testbed.init_taskqueue_stub()
+        ndb.get_context().clear_cache()
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def new_game(self, word, attempts=26, user_name='test'):
+        """Returns a stored game of the word, for a new user"""
+        from models import Game, User
+        user = User.create_user(user_name, None)
+        game = Game(parent=user.key, user=user.key, guess_word=word,
+                    word_in_progress='_' * len(word),
+                    guessed_letters='', attempts_allowed=attempts,
+                    attempts_remaining=attempts)
+        game.put()
+        return game
@@ -0,0 +1,47 @@
+"""test_cache.py - Tiers of the entity cache behind get_cached.
+
+A read is served by the in-process cache, by ndb's context cache or
+memcache, or by a datastore Get, and each tier has its own counter.
+"""
+
+from google.appengine.ext import ndb
+
+import utils
+from tests.base import TestbedCase
+
+
+class CachedEntity(ndb.Model):
+    name = ndb.StringProperty()
+
+
+class GetCachedTest(TestbedCase):
+
+    def setUp(self):
+        super(GetCachedTest, self).setUp()
+        utils.entity_cache.clear()
+        self.key = CachedEntity(name='cached').put()
+        ndb.get_context().clear_cache()
+
+    def counts(self):
+        return utils.cache_stats()['instance']
+
+    def assert_read(self, tier):
+        before = self.counts()
+        self.assertEqual(utils.get_cached(self.key).name, 'cached')
+        after = self.counts()
+        self.assertEqual(
+            dict((name, after[name] - before[name]) for name in after),
+            dict((name, int(name == tier)) for name in utils.STATS_NAMES))
+
+    def test_tiers(self):
+        self.assert_read('datastore_reads')
+        self.assert_read('local_hits')
+        # Dropped from this instance, the entity is still in memcache
+        utils.entity_cache.clear()
+        ndb.get_context().clear_cache()
+        self.assert_read('ndb_cache_hits')
+
+    def test_context_cache(self):
+        self.key.get()
+        utils.entity_cache.clear()
+        self.assert_read('ndb_cache_hits')
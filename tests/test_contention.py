@@ -0,0 +1,88 @@
+"""test_contention.py - Consistency of concurrent moves on a single game.
+
+Several threads play the same game at once through HangmanApi.make_move. A
+move answered with a conflict is sent again. The stored game must then match
+the moves that were accepted, whatever order they were applied in.
+"""
+
+import string
+import threading
+
+import endpoints
+
+from tests.base import TestbedCase
+
+WORD = 'RELATIONSHIP'
+
+
+class ContentionTest(TestbedCase):
+
+    def setUp(self):
+        super(ContentionTest, self).setUp()
+        from api import HangmanApi, MAKE_MOVE_REQUEST
+        self.api = HangmanApi()
+        self.request_class = MAKE_MOVE_REQUEST.combined_message_class
+
+    def play(self, urlsafe_key, letters, accepted, lock):
+        """Sends the letters in order, sending a move again on conflict"""
+        for letter in letters:
+            while True:
+                request = self.request_class(urlsafe_game_key=urlsafe_key,
+                                             guess=letter)
+                try:
+                    form = self.api.make_move(request)
+                except endpoints.ConflictException:
+                    continue
+                break
+            if not form.message.startswith('Game already finished'):
+                with lock:
+                    accepted.append(letter)
+
+    def play_concurrently(self, threads, attempts=26):
+        """Plays every letter of the alphabet, split over the threads.
+        Returns the game key and the accepted letters."""
+        game = self.new_game(WORD, attempts=attempts)
+        accepted = []
+        lock = threading.Lock()
+        workers = [threading.Thread(
+            target=self.play,
+            args=(game.key.urlsafe(), string.ascii_uppercase[i::threads],
+                  accepted, lock))
+            for i in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return game.key, accepted
+
+    def assert_consistent(self, game_key, accepted):
+        """Asserts that the stored game matches the accepted moves"""
+        # The moves were saved by the worker threads, in their own ndb
+        # contexts: skip the stale copy cached by this thread's context
+        game = game_key.get(use_cache=False, use_memcache=False)
+        self.assertEqual(sorted(game.guessed_letters), sorted(accepted))
+        misses = [letter for letter in accepted if letter not in WORD]
+        self.assertEqual(game.attempts_remaining,
+                         game.attempts_allowed - len(misses))
+        expected = ''.join(char if char in accepted else '_'
+                           for char in WORD)
+        self.assertEqual(game.word_in_progress, expected)
+        self.assertEqual(game.game_over,
+                         expected == WORD or game.attempts_remaining < 1)
+        if game.history_inline:
+            history = len(game.move_log.split())
+        else:
+            history = game.history_query().count()
+        hits = sum(1 for char in WORD if char in accepted)
+        lost = 1 if game.attempts_remaining < 1 else 0
+        self.assertEqual(history, hits + len(misses) + lost)
+
+    def test_single_thread(self):
+        self.assert_consistent(*self.play_concurrently(1))
+
+    def test_concurrent_moves(self):
+        for threads in (2, 4, 8):
+            self.assert_consistent(*self.play_concurrently(threads))
+
+    def test_concurrent_moves_until_lost(self):
+        self.assert_consistent(*self.play_concurrently(4, attempts=3))
@@ -0,0 +1,127 @@
+"""test_moves.py - Datastore writes of a move.
+
+Every entity changed by a move (the Game, its GameHistory entries and, when
+the game ends, the Score and UserStats) is written with a single Put RPC.
+"""
+
+import endpoints
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.api import datastore_errors
+from google.appengine.ext import ndb
+
+import counters
+
+from tests.base import TestbedCase
+
+WORD = 'RELATIONSHIP'
+MOVE_KINDS = frozenset(['Game', 'GameHistory', 'Score', 'UserStats'])
+
+
+class MovePutsTest(TestbedCase):
+
+    def setUp(self):
+        super(MovePutsTest, self).setUp()
+        from api import HangmanApi, MAKE_MOVE_REQUEST, MAKE_MOVES_REQUEST
+        self.api = HangmanApi()
+        self.move_request = MAKE_MOVE_REQUEST.combined_message_class
+        self.moves_request = MAKE_MOVES_REQUEST.combined_message_class
+        # The kinds written by each datastore Put RPC. The testbed installs
+        # a new stub map on activate, so the hook goes with it.
+        self.puts = []
+        apiproxy_stub_map.apiproxy.GetPreCallHooks().Append(
+            'count_puts', self._record_put, 'datastore_v3')
+
+    def _record_put(self, service, call, request, response):
+        if call == 'Put':
+            self.puts.append(frozenset(
+                entity.key().path().element_list()[-1].type()
+                for entity in request.entity_list()))
+
+    def move_puts(self):
+        """Returns the kinds written by each Put RPC holding a move entity"""
+        return [kinds for kinds in self.puts if kinds & MOVE_KINDS]
+
+    def make_move(self, game, guess):
+        del self.puts[:]
+        return self.api.make_move(self.move_request(
+            urlsafe_game_key=game.key.urlsafe(), guess=guess))
+
+    def test_single_hit(self):
+        game = self.new_game(WORD)
+        self.make_move(game, 'E')
+        self.assertEqual(game.key.get().word_in_progress, '_E__________')
+        self.assertEqual(self.move_puts(),
+                         [frozenset(['Game', 'GameHistory'])])
+
+    def test_multi_hit(self):
+        game = self.new_game(WORD)
+        self.make_move(game, 'I')
+        self.assertEqual(game.key.get().word_in_progress, '_____I____I_')
+        self.assertEqual(self.move_puts(),
+                         [frozenset(['Game', 'GameHistory'])])
+        self.assertEqual(game.history_query().count(), 2)
+
+    def test_winning_move(self):
+        game = self.new_game(WORD)
+        self.api.make_moves(self.moves_request(
+            urlsafe_game_key=game.key.urlsafe(), guesses=list('RELATIONSH')))
+        form = self.make_move(game, 'P')
+        self.assertTrue(form.game_over)
+        self.assertEqual(self.move_puts(), [MOVE_KINDS])
+
+    def test_losing_move(self):
+        game = self.new_game(WORD, attempts=1)
+        form = self.make_move(game, 'Z')
+        self.assertTrue(form.game_over)
+        self.assertEqual(self.move_puts(), [MOVE_KINDS])
+
+    def test_repeated_guess_writes_nothing(self):
+        game = self.new_game(WORD)
+        self.make_move(game, 'E')
+        self.make_move(game, 'E')
+        self.assertEqual(self.move_puts(), [])
+
+    def test_too_many_guesses(self):
+        game = self.new_game(WORD)
+        del self.puts[:]
+        with self.assertRaises(endpoints.BadRequestException):
+            self.api.make_moves(self.moves_request(
+                urlsafe_game_key=game.key.urlsafe(), guesses=['E'] * 27))
+        self.assertEqual(self.move_puts(), [])
+
+    def test_counter_failure_after_commit(self):
+        @ndb.tasklet
+        def fail(*args, **kwargs):
+            yield ndb.sleep(0)
+            raise datastore_errors.TransactionFailedError('contention')
+        add_async = counters.add_async
+        counters.add_async = fail
+        self.addCleanup(setattr, counters, 'add_async', add_async)
+        game = self.new_game(WORD, attempts=1)
+        # The saved move is answered as played, not as a conflict
+        form = self.make_move(game, 'Z')
+        self.assertTrue(form.game_over)
+        self.assertTrue(game.key.get().game_over)
+
+    def old_game(self, guesses):
+        """Returns a game started before guessed_letters was stored, with
+        GameHistory entries for the guesses"""
+        from models import GameHistory
+        game = self.new_game(WORD)
+        game.guessed_letters = None
+        game.put()
+        for guess in guesses:
+            GameHistory.create_game_history(game.key.urlsafe(), guess,
+                                            guess in WORD, -1, 'Not found')
+        return game
+
+    def test_old_game_repeated_guess_is_detected(self):
+        game = self.old_game('EZ')
+        self.make_move(game, 'Z')
+        self.assertEqual(game.key.get().attempts_remaining, 26)
+        self.assertEqual(game.history_query().count(), 2)
+
+    def test_old_game_letters_are_saved_with_the_next_move(self):
+        game = self.old_game('EZE')
+        self.make_move(game, 'A')
+        self.assertEqual(game.key.get().guessed_letters, 'EZA')
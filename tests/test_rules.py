@@ -0,0 +1,53 @@
+"""test_rules.py - Guesses the rules accept.
+
+Only the letters A to Z, in either case, are valid guesses, so a game never
+holds a letter the hint engine cannot index. Runs without the SDK.
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import hints
+import rules
+import words
+
+
+class GuessTest(unittest.TestCase):
+
+    def test_ascii_letters_are_accepted(self):
+        state = rules.GameState('HANGMAN')
+        self.assertTrue(state.guess('a').accepted)
+        self.assertTrue(state.guess(u'N').accepted)
+        self.assertEqual(state.guessed_letters, 'AN')
+
+    def test_non_ascii_letters_are_rejected(self):
+        state = rules.GameState('HANGMAN')
+        for guess in (u'\xe9', u'\xc9', u'\xdf', u'\u0391'):
+            result = state.guess(guess)
+            self.assertFalse(result.accepted)
+            self.assertEqual(result.message,
+                             'Only alphabetic character is allowed!')
+        self.assertEqual(state.guessed_letters, '')
+        self.assertEqual(state.attempts_remaining, 10)
+
+    def test_other_guesses_are_rejected(self):
+        state = rules.GameState('HANGMAN')
+        for guess in ('', '1', '_', 'AB'):
+            self.assertFalse(state.guess(guess).accepted)
+        self.assertEqual(state.guessed_letters, '')
+
+
+class HintTest(unittest.TestCase):
+
+    def test_non_ascii_tried_letters_are_ignored(self):
+        index = words.WordIndex(words.build_index(words.DEFAULT_WORDS))
+        engine = hints.HintEngine(index)
+        self.assertEqual(engine.hint('_____', u'\xc9'),
+                         engine.hint('_____', ''))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,30 @@
+"""test_users.py - Lookups of users by name through memcache."""
+
+from google.appengine.ext import ndb
+
+from models import User
+from tests.base import TestbedCase
+
+
+class GetByNameTest(TestbedCase):
+
+    def test_missing_name(self):
+        self.assertIsNone(User.get_by_name('nobody'))
+        User.create_user('nobody', None)
+        self.assertEqual(User.get_by_name('nobody').name, 'nobody')
+
+    def test_created_during_lookup(self):
+        get_multi_async = ndb.get_multi_async
+
+        @ndb.tasklet
+        def create_after_read(keys, **kwargs):
+            # The user is created once the lookup found no entity
+            results = yield get_multi_async(keys, **kwargs)
+            User.create_user('late', None)
+            raise ndb.Return(results)
+        ndb.get_multi_async = create_after_read
+        try:
+            self.assertIsNone(User.get_by_name('late'))
+        finally:
+            ndb.get_multi_async = get_multi_async
+        self.assertEqual(User.get_by_name('late').name, 'late')
@@ -1,35 +1,293 @@
 """utils.py - File for collecting general utility functions."""
 
+import collections
 import logging
+import threading
+import time
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.api import datastore_errors
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from google.appengine.datastore.datastore_query import Cursor
 from google.appengine.ext import ndb
-import endpoints
+from protorpc import protojson
 
-def get_by_urlsafe(urlsafe, model):
-    """Returns an ndb.Model entity that the urlsafe key points to. Checks
-        that the type of entity returned is of the correct kind. Raises an
-        error if the key String is malformed or the entity is of the incorrect
-        kind
+# In-process cache: entries kept per instance for a few seconds. Behind it
+# is ndb's own memcache layer, which locks an entity's entry while it is
+# written, so a read that overlaps a write cannot cache the old entity.
+ENTITY_CACHE_SIZE = 1000
+ENTITY_CACHE_TTL = 5
+# Encoded API responses, keyed by game version: those of finished games do
+# not expire, those of active games become unreachable after the next move
+RESPONSE_MEMCACHE_PREFIX = 'RESPONSE:'
+RESPONSE_MEMCACHE_TTL = 60 * 60
+# Counters are added to the memcache totals every STATS_FLUSH lookups
+ENTITY_STATS_PREFIX = 'ENTITY_CACHE_STATS:'
+STATS_FLUSH = 100
+# local_hits: served by the in-process cache; ndb_cache_hits: read through
+# ndb without a datastore Get (context cache or memcache); datastore_reads:
+# read through ndb with a datastore Get RPC
+STATS_NAMES = ('local_hits', 'ndb_cache_hits', 'datastore_reads')
+# Results per page of the list endpoints
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+class LRUCache(object):
+    """Bounded in-process LRU cache whose entries expire after ttl seconds"""
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self._items = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.pop(key, None)
+            if item is None or item[0] < time.time():
+                return None
+            self._items[key] = item
+            return item[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = (time.time() + self.ttl, value)
+            while len(self._items) > self.size:
+                self._items.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+entity_cache = LRUCache(ENTITY_CACHE_SIZE, ENTITY_CACHE_TTL)
+_stats = collections.Counter()
+_pending_stats = collections.Counter()
+_stats_lock = threading.Lock()
+# Datastore Get RPCs made by the current thread, counted by _get_rpc_hook
+_local = threading.local()
+_hooked_apiproxy = None
+
+
+def _count(name):
+    """Counts a cache lookup result, per instance and in memcache"""
+    with _stats_lock:
+        _stats[name] += 1
+        _pending_stats[name] += 1
+        if sum(_pending_stats.values()) < STATS_FLUSH:
+            return
+        pending = dict(_pending_stats)
+        _pending_stats.clear()
+    memcache.offset_multi(pending, key_prefix=ENTITY_STATS_PREFIX,
+                          initial_value=0)
+
+
+def cache_stats():
+    """Returns the entity cache hit/miss counters of this instance and the
+    totals of all instances"""
+    with _stats_lock:
+        instance = dict((name, _stats[name]) for name in STATS_NAMES)
+    totals = memcache.get_multi(STATS_NAMES, key_prefix=ENTITY_STATS_PREFIX)
+    return {'instance': instance,
+            'all_instances': dict((name, int(totals.get(name) or 0))
+                                  for name in STATS_NAMES)}
+
+
+def uncache_entity(key):
+    """Drops the entity from the in-process cache. Called when it is
+    written; ndb invalidates its memcache entry itself."""
+    entity_cache.delete(key.urlsafe())
+
+
+def _get_rpc_hook(service, call, request, response):
+    if service == 'datastore_v3' and call == 'Get':
+        _local.datastore_gets = getattr(_local, 'datastore_gets', 0) + 1
+
+
+def _install_hook():
+    """Adds the Get RPC hook to the current apiproxy (replaced by the
+    testbed)"""
+    global _hooked_apiproxy
+    apiproxy = apiproxy_stub_map.apiproxy
+    if apiproxy is not _hooked_apiproxy:
+        with _stats_lock:
+            if apiproxy is not _hooked_apiproxy:
+                apiproxy.GetPostCallHooks().Append('entity_cache_stats',
+                                                   _get_rpc_hook)
+                _hooked_apiproxy = apiproxy
+
+
+def get_cached(key):
+    """Returns the entity from the in-process cache, or reads it through
+    ndb (context cache, memcache, datastore) and caches it. A read through
+    ndb is counted as a datastore read when the thread made a datastore Get
+    RPC meanwhile."""
+    urlsafe = key.urlsafe()
+    entity = entity_cache.get(urlsafe)
+    if entity is not None:
+        _count('local_hits')
+        return entity
+    _install_hook()
+    gets_before = getattr(_local, 'datastore_gets', 0)
+    entity = key.get()
+    if getattr(_local, 'datastore_gets', 0) > gets_before:
+        _count('datastore_reads')
+    else:
+        _count('ndb_cache_hits')
+    if entity is None:
+        return None
+    entity_cache.set(urlsafe, entity)
+    return entity
+
+
+def get_cached_response(key, message_type):
+    """Returns the message cached by cache_response, or None"""
+    data = memcache.get(RESPONSE_MEMCACHE_PREFIX + key)
+    if data is None:
+        return None
+    return protojson.decode_message(message_type, data)
+
+
+def cache_response(key, message, final=False):
+    """Caches an API response. The key must include the version of the data
+    the response was built from. final responses, which can never change,
+    are kept until memcache evicts them."""
+    memcache.set(RESPONSE_MEMCACHE_PREFIX + key,
+                 protojson.encode_message(message),
+                 time=0 if final else RESPONSE_MEMCACHE_TTL)
+
+
+def wait_all(futures):
+    """Waits for the futures, which run in parallel, and raises the first
+    exception any of them raised"""
+    for future in futures:
+        future.get_result()
+
+
+def wait_after_commit(futures, what):
+    """Waits for the updates that follow a committed change, such as the
+    game counters and the leaderboards. The change itself is saved, so a
+    datastore error here is logged instead of raised: the caller must not
+    report the change as failed. counters.reconcile and the leaderboard
+    rebuild repair what was missed."""
+    for future in futures:
+        try:
+            future.get_result()
+        except datastore_errors.Error:
+            logging.exception('Update after %s failed', what)
+
+
+def _bad_request(message):
+    """Returns an endpoints.BadRequestException. Endpoints is imported here,
+    so the task handlers that use this module do not load it."""
+    import endpoints
+    return endpoints.BadRequestException(message)
+
+
+def key_from_urlsafe(urlsafe, model):
+    """Returns the ndb.Key of a urlsafe key string without reading the entity.
+    Raises an error if the key String is malformed or of the incorrect kind
     Args:
         urlsafe: A urlsafe key string
         model: The expected entity kind
     Returns:
-        The entity that the urlsafe Key string points to or None if no entity
-        exists.
+        The ndb.Key the urlsafe Key string points to.
     Raises:
         ValueError:"""
     try:
         key = ndb.Key(urlsafe=urlsafe)
     except TypeError:
-        raise endpoints.BadRequestException('Invalid Key')
+        raise _bad_request('Invalid Key')
     except Exception, e:
         if e.__class__.__name__ == 'ProtocolBufferDecodeError':
-            raise endpoints.BadRequestException('Invalid Key')
+            raise _bad_request('Invalid Key')
         else:
             raise
+    if key.kind() != model._get_kind():
+        raise ValueError('Incorrect Kind')
+    return key
 
-    entity = key.get()
+
+def get_by_urlsafe(urlsafe, model, use_cache=True):
+    """Returns an ndb.Model entity that the urlsafe key points to. Checks
+        that the type of entity returned is of the correct kind. Raises an
+        error if the key String is malformed or the entity is of the incorrect
+        kind
+    Args:
+        urlsafe: A urlsafe key string
+        model: The expected entity kind
+        use_cache: Read through the entity cache. Pass False before
+            modifying the entity, to read it from the datastore.
+    Returns:
+        The entity that the urlsafe Key string points to or None if no entity
+        exists.
+    Raises:
+        ValueError:"""
+    key = key_from_urlsafe(urlsafe, model)
+    if use_cache:
+        entity = get_cached(key)
+    else:
+        entity = key.get()
     if not entity:
         return None
     if not isinstance(entity, model):
         raise ValueError('Incorrect Kind')
     return entity
+
+
+def fetch_page(query, page_size=None, cursor=None, **kwargs):
+    """Returns one page of the query results and the urlsafe cursor of the
+    next page, or None on the last page.
+    Args:
+        query: The ndb.Query to run
+        page_size: Results per page, DEFAULT_PAGE_SIZE if not given and at
+            most MAX_PAGE_SIZE
+        cursor: The urlsafe cursor returned with the previous page
+        kwargs: Query options such as keys_only
+    Raises:
+        endpoints.BadRequestException: the cursor is malformed"""
+    page_size = min(page_size or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
+    try:
+        start_cursor = Cursor(urlsafe=cursor) if cursor else None
+    except (TypeError, datastore_errors.BadValueError):
+        raise _bad_request('Invalid cursor')
+    results, next_cursor, more = query.fetch_page(
+        page_size, start_cursor=start_cursor, **kwargs)
+    if more and next_cursor:
+        return results, next_cursor.urlsafe()
+    return results, None
+
+
+def slice_page(items, page_size=None, cursor=None):
+    """Returns one page of a list already in memory and the cursor of the
+    next page, or None on the last page. The cursor is the offset of the
+    page, as a string.
+    Raises:
+        endpoints.BadRequestException: the cursor is malformed"""
+    page_size = min(page_size or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
+    try:
+        offset = int(cursor) if cursor else 0
+    except ValueError:
+        raise _bad_request('Invalid cursor')
+    if offset < 0:
+        raise _bad_request('Invalid cursor')
+    end = offset + page_size
+    if end < len(items):
+        return items[offset:end], str(end)
+    return items[offset:end], None
+
+
+def add_named_task(name, url, params, **kwargs):
+    """Enqueue a named task. A retried handler enqueues the same names again,
+    which the queue ignores, so every step of a run is added only once.
+    kwargs are passed to taskqueue.add, e.g. countdown."""
+    try:
+        taskqueue.add(name=name, url=url, params=params, **kwargs)
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        pass
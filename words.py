@@ -0,0 +1,175 @@
+"""words.py - Indexed word dictionary used to pick the word of a new game.
+
+The dictionary is stored in a compact file (words.dat). Words are grouped in
+buckets by length and number of distinct letters; inside a bucket every word
+has the same length, so word i of a bucket is a plain slice of the file. The
+file is memory-mapped when possible and loaded once per instance, on first
+use. Build it from a plain word list (one word per line) with:
+
+    python words.py words.txt words.dat
+"""
+
+import bisect
+import os
+import random
+import struct
+import sys
+import threading
+
+try:
+    import mmap
+except ImportError:
+    mmap = None
+
+MAGIC = 'HWD1'
+# magic, number of buckets
+HEADER = struct.Struct('<4sI')
+# word length, distinct letters, offset of the first word, number of words
+BUCKET = struct.Struct('<BBII')
+
+WORDS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          'words.dat')
+# Used when no dictionary file is deployed
+DEFAULT_WORDS = ['HANGMAN', 'ZOO', 'PYTHON', 'GRANDMOTHER',
+                 'RELATIONSHIP', 'SWIFT', 'PRESIDENT']
+# Difficulty level -> (minimum, maximum) word length
+DIFFICULTIES = {'easy': (1, 5),
+                'medium': (6, 8),
+                'hard': (9, 255)}
+
+
+def build_index(words):
+    """Returns the packed dictionary data for an iterable of words"""
+    buckets = {}
+    for word in words:
+        word = word.strip().upper()
+        if not word or len(word) > 255 or \
+                not all('A' <= char <= 'Z' for char in word):
+            continue
+        buckets.setdefault((len(word), len(set(word))), set()).add(word)
+
+    table = []
+    data = []
+    offset = HEADER.size + BUCKET.size * len(buckets)
+    for length, distinct in sorted(buckets):
+        bucket = sorted(buckets[(length, distinct)])
+        table.append(BUCKET.pack(length, distinct, offset, len(bucket)))
+        data.append(''.join(bucket))
+        offset += length * len(bucket)
+    return HEADER.pack(MAGIC, len(buckets)) + ''.join(table) + ''.join(data)
+
+
+class WordIndex(object):
+    """Random word selection over packed dictionary data"""
+
+    def __init__(self, data):
+        magic, count = HEADER.unpack_from(data, 0)
+        if magic != MAGIC:
+            raise ValueError('Not a word dictionary file')
+        self._data = data
+        self._buckets = [BUCKET.unpack_from(data, HEADER.size + i * BUCKET.size)
+                         for i in range(count)]
+        # Filter -> (matching buckets, cumulative word counts). Only filters
+        # on lengths and letter counts that exist are cached, so the cache
+        # is bounded by the buckets whatever the requests ask for.
+        self._selections = {}
+        self._lengths = set(bucket[0] for bucket in self._buckets)
+        self._letter_counts = set(bucket[1] for bucket in self._buckets)
+
+    def __len__(self):
+        return sum(bucket[3] for bucket in self._buckets)
+
+    @property
+    def data(self):
+        """The packed dictionary data"""
+        return self._data
+
+    def buckets(self, length=None):
+        """Returns the (length, distinct letters, offset, count) buckets,
+        only those of one word length if given"""
+        return [bucket for bucket in self._buckets
+                if length is None or bucket[0] == length]
+
+    def _selection(self, difficulty, length, letters):
+        key = (difficulty, length, letters)
+        selection = self._selections.get(key)
+        if selection is None:
+            if difficulty is None:
+                min_length, max_length = 1, 255
+            elif difficulty in DIFFICULTIES:
+                min_length, max_length = DIFFICULTIES[difficulty]
+            else:
+                raise ValueError('Unknown difficulty {}'.format(difficulty))
+            if (length is not None and length not in self._lengths) or \
+                    (letters is not None and
+                     letters not in self._letter_counts):
+                return [], []
+            buckets = [bucket for bucket in self._buckets
+                       if min_length <= bucket[0] <= max_length and
+                       (length is None or bucket[0] == length) and
+                       (letters is None or bucket[1] == letters)]
+            totals = []
+            total = 0
+            for bucket in buckets:
+                total += bucket[3]
+                totals.append(total)
+            selection = (buckets, totals)
+            self._selections[key] = selection
+        return selection
+
+    def count(self, difficulty=None, length=None, letters=None):
+        """Number of words matching the filter"""
+        totals = self._selection(difficulty, length, letters)[1]
+        return totals[-1] if totals else 0
+
+    def random_word(self, difficulty=None, length=None, letters=None):
+        """Returns a random word matching the difficulty, the word length and
+        the number of distinct letters. Raises ValueError if none match."""
+        buckets, totals = self._selection(difficulty, length, letters)
+        if not totals:
+            raise ValueError('No word matches the requested filter')
+        pick = random.randrange(totals[-1])
+        i = bisect.bisect_right(totals, pick)
+        word_length, _, offset, _ = buckets[i]
+        if i:
+            pick -= totals[i - 1]
+        start = offset + pick * word_length
+        return self._data[start:start + word_length]
+
+
+def load(path=WORDS_FILE):
+    """Loads the dictionary file, memory-mapped if mmap is available. Falls
+    back to the default words when the file does not exist."""
+    if not os.path.exists(path):
+        return WordIndex(build_index(DEFAULT_WORDS))
+    with open(path, 'rb') as words_file:
+        if mmap is not None:
+            data = mmap.mmap(words_file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            data = words_file.read()
+    return WordIndex(data)
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    """Returns the instance wide WordIndex, loading it on first use"""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = load()
+    return _index
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        sys.exit('Usage: python words.py WORD_LIST OUTPUT_FILE')
+    with open(sys.argv[1]) as source:
+        packed = build_index(source)
+    with open(sys.argv[2], 'wb') as output:
+        output.write(packed)
+    print('{} words written to {}'.format(len(WordIndex(packed)),
+                                          sys.argv[2]))